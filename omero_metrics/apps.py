@@ -15,6 +15,9 @@ class OMEROMetricsConfig(AppConfig):
         self.add_plotly_components()
         self.add_plotly_dash_settings()
         self.add_context_processor()
+        self.configure_caches()
+        self.configure_context_store()
+        self.configure_context_budget()
 
     def add_staticfiles_finders(self):
         """Add custom static files finders for django-plotly-dash."""
@@ -65,6 +68,35 @@ class OMEROMetricsConfig(AppConfig):
         else:
             settings.PLOTLY_DASH = plotly_dash_settings
 
+    def configure_caches(self):
+        """Create the caches from their settings. They are not created on import."""
+        from omero_metrics.tools import cache
+
+        for get_cache in cache.CACHE_ACCESSORS:
+            get_cache()
+
+    def configure_context_store(self):
+        """Select the store of the Dash contexts from the OMERO_METRICS_CONTEXT_STORE setting."""
+        from omero_metrics.tools import context_store
+
+        store_name = getattr(settings, "OMERO_METRICS_CONTEXT_STORE", "file")
+        if store_name not in context_store.CONTEXT_STORES:
+            logging.getLogger(__name__).error(
+                f"Unknown context store {store_name}. "
+                f"Use one of {list(context_store.CONTEXT_STORES)}"
+            )
+            return
+        context_store.set_context_store(context_store.CONTEXT_STORES[store_name]())
+
+    def configure_context_budget(self):
+        """Set the longest edge of the planes in the dataset contexts from the
+        OMERO_METRICS_CONTEXT_MAX_EDGE setting."""
+        from omero_metrics.tools import context_loaders
+
+        max_edge = getattr(settings, "OMERO_METRICS_CONTEXT_MAX_EDGE", None)
+        if max_edge is not None:
+            context_loaders.CONTEXT_MAX_EDGE = int(max_edge)
+
     def add_context_processor(self):
         """Ensure the required context processor is included."""
         if hasattr(settings, "TEMPLATES") and len(settings.TEMPLATES) > 0:
@@ -19,7 +19,8 @@ from omero_metrics.styles import (
     THEME,
 )
 from omero_metrics.tools import load
-from omero_metrics.tools.serializers import deserialize
+from omero_metrics.tools.context_store import get_context
+from omero_metrics.tools.serializers import deserialize, deserialize_path
 
 dashboard_name = "omero_dataset_foi"
 omero_dataset_foi = DjangoDash(
@@ -183,7 +184,7 @@ dsc.register_download_table_callback(omero_dataset_foi)
 )
 def update_dropdown_menu(*args, **kwargs):
     try:
-        channel_names = kwargs["session_state"]["context"]["channel_names"]
+        channel_names = get_context(kwargs)["channel_names"]
         return [
             {"label": str(name), "value": str(i)}
             for i, name in enumerate(channel_names)
@@ -201,9 +202,8 @@ def update_dropdown_menu(*args, **kwargs):
 def update_intensity_map(channel, **kwargs):
     try:
         channel = int(channel)
-        images = deserialize(kwargs["session_state"]["context"])["image_data"]
-        image = images[channel]
-        image_channel = image[0, 0, :, :]
+        images = deserialize_path(get_context(kwargs), "image_data")
+        image_channel = images[channel]
         image_channel = rescale_intensity(
             image_channel,
             in_range=(0, image_channel.max()),
@@ -253,9 +253,10 @@ def update_intensity_map(channel, **kwargs):
 def update_profile_type(channel, curve_type, **kwargs):
     try:
         df_intensity_profiles = load.load_table_mm_metrics(
-            deserialize(kwargs["session_state"]["context"]["mm_dataset"]).output[
-                "intensity_profiles"
-            ]
+            deserialize_path(
+                get_context(kwargs),
+                "mm_dataset.output.intensity_profiles",
+            )
         )
 
         df_profile = df_intensity_profiles.filter(regex=f"ch0*{channel}_")
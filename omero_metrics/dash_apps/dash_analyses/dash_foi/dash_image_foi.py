@@ -14,7 +14,8 @@ from omero_metrics.styles import (
     THEME,
 )
 from omero_metrics.tools import load
-from omero_metrics.tools.serializers import deserialize
+from omero_metrics.tools.context_store import get_context
+from omero_metrics.tools.serializers import deserialize, deserialize_path
 
 dashboard_name = "omero_image_foi"
 omero_image_foi = DjangoDash(
@@ -248,7 +249,7 @@ omero_image_foi.layout = dmc.MantineProvider(
     [dash.dependencies.Input("blank-input", "children")],
 )
 def callback_channel(_, **kwargs):
-    mm_image = deserialize(kwargs["session_state"]["context"]["mm_image"])
+    mm_image = deserialize(get_context(kwargs)["mm_image"])
     return [
         {"label": c.name, "value": str(i), "description": f"Channel {i+1}"}
         for i, c in enumerate(mm_image.channel_series.channels)
@@ -266,8 +267,8 @@ def callback_channel(_, **kwargs):
     ],
 )
 def callback_image(channel, color, checked_contour, inverted_color, roi, **kwargs):
-    mm_dataset = deserialize(kwargs["session_state"]["context"]["mm_dataset"])
-    mm_image = deserialize(kwargs["session_state"]["context"]["mm_image"])
+    mm_dataset = deserialize(get_context(kwargs)["mm_dataset"])
+    mm_image = deserialize(get_context(kwargs)["mm_image"])
     image_id = mm_image.data_reference.omero_object_id
     if inverted_color:
         color = color + "_r"
@@ -380,11 +381,12 @@ def callback_image(channel, color, checked_contour, inverted_color, roi, **kwarg
     [dash.dependencies.Input("channel_dropdown", "value")],
 )
 def update_intensity_profiles(channel, **kwargs):
-    image_index = int(kwargs["session_state"]["context"]["image_index"])
+    image_index = int(get_context(kwargs)["image_index"])
     df_intensity_profiles = load.load_table_mm_metrics(
-        deserialize(kwargs["session_state"]["context"]["mm_dataset"]).output[
-            "intensity_profiles"
-        ][image_index]
+        deserialize_path(
+            get_context(kwargs),
+            f"mm_dataset.output.intensity_profiles.{image_index}",
+        )
     )
     df_profile = df_intensity_profiles.filter(regex=f"ch0*{channel}_")
     df_profile.columns = (
@@ -12,6 +12,7 @@ from plotly.subplots import make_subplots
 import omero_metrics.dash_apps.dash_utils.omero_metrics_components as my_components
 from omero_metrics.styles import MANTINE_THEME, THEME
 from omero_metrics.tools import load
+from omero_metrics.tools.context_store import get_context
 from omero_metrics.tools.serializers import deserialize
 
 logger = logging.getLogger(__name__)
@@ -194,7 +195,7 @@ omero_image_average_bead.layout = dmc.MantineProvider(
 )
 def update_image(channel_index, color, invert, **kwargs):
     try:
-        context = deserialize(kwargs["session_state"]["context"])
+        context = deserialize(get_context(kwargs))
         mm_dataset = context["mm_dataset"]
         mm_image = context["mm_image"]
         image_id = mm_image.data_reference.omero_object_id
@@ -457,7 +458,7 @@ def update_image(channel_index, color, invert, **kwargs):
     [dash.dependencies.Input("blank-input", "children")],
 )
 def update_channels_average_image(_, **kwargs):
-    context = deserialize(kwargs["session_state"]["context"])
+    context = deserialize(get_context(kwargs))
     channel_series = context["mm_image"].channel_series
     return [
         {"label": c.name, "value": str(i)}
@@ -12,7 +12,8 @@ from plotly.subplots import make_subplots
 import omero_metrics.dash_apps.dash_utils.omero_metrics_components as my_components
 from omero_metrics.styles import MANTINE_THEME, THEME
 from omero_metrics.tools import load
-from omero_metrics.tools.serializers import deserialize
+from omero_metrics.tools.context_store import get_context
+from omero_metrics.tools.serializers import deserialize, deserialize_path
 
 logger = logging.getLogger(__name__)
 dashboard_name = "omero_image_psf_beads"
@@ -257,7 +258,7 @@ omero_image_psf_beads.layout = dmc.MantineProvider(
 )
 def update_image(channel_index, color, invert, contour, roi, beads_info, **kwargs):
     try:
-        context = deserialize(kwargs["session_state"]["context"])
+        context = deserialize(get_context(kwargs))
         mm_dataset = context["mm_dataset"]
         mm_image = context["mm_image"]
         image_id = mm_image.data_reference.omero_object_id
@@ -336,8 +337,7 @@ def update_image(channel_index, color, invert, contour, roi, beads_info, **kwarg
     [dash.dependencies.Input("blank-input", "children")],
 )
 def update_channels_psf_image(_, **kwargs):
-    context = deserialize(kwargs["session_state"]["context"])
-    channel_series = context["mm_image"].channel_series
+    channel_series = deserialize_path(get_context(kwargs), "mm_image.channel_series")
     return [
         {"label": c.name, "value": str(i)}
         for i, c in enumerate(channel_series.channels)
@@ -360,7 +360,7 @@ def callback_mip(points, channel_index, color, invert, **kwargs):
     if point["curveNumber"] != 1:
         return dash.no_update
 
-    context = deserialize(kwargs["session_state"]["context"])
+    context = deserialize(get_context(kwargs))
     bead_index = point["pointNumber"]
     mm_image = context["mm_image"]
     image_id = mm_image.data_reference.omero_object_id
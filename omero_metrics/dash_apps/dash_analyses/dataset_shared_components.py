@@ -4,7 +4,7 @@ from time import sleep
 import dash_mantine_components as dmc
 from dash import dcc, dependencies, html, no_update
 from dash_iconify import DashIconify
-from linkml_runtime.dumpers import JSONDumper, YAMLDumper
+from django.urls import reverse
 
 from omero_metrics import views
 from omero_metrics.dash_apps.dash_utils import omero_metrics_components
@@ -16,7 +16,8 @@ from omero_metrics.styles import (
     THEME,
 )
 from omero_metrics.tools import load
-from omero_metrics.tools.serializers import deserialize
+from omero_metrics.tools.context_store import get_context
+from omero_metrics.tools.serializers import deserialize, deserialize_path
 
 
 # COMPONENTS
@@ -224,7 +225,6 @@ download_group = dmc.Group(
             ],
             trigger="click",
         ),
-        dcc.Download(id="download"),
     ]
 )
 
@@ -260,7 +260,7 @@ def register_delete_dataset_callback(app):
         **kwargs,
     ):
         triggered_button = kwargs["callback_context"].triggered[0]["prop_id"]
-        context = deserialize(kwargs["session_state"]["context"])
+        context = deserialize(get_context(kwargs))
         dataset_id = context["mm_dataset"].data_reference.omero_object_id
         request = kwargs["request"]
         opened = not confirm_delete_modal_opened
@@ -282,44 +282,21 @@ def register_delete_dataset_callback(app):
 
 def register_download_datasets_callback(app):
     @app.expanded_callback(
-        dependencies.Output("download", "data"),
-        [
-            dependencies.Input("download-yaml", "n_clicks"),
-            dependencies.Input("download-json", "n_clicks"),
-            dependencies.Input("download-text", "n_clicks"),
-        ],
-        prevent_initial_call=True,
+        dependencies.Output("download-yaml", "href"),
+        dependencies.Output("download-json", "href"),
+        dependencies.Output("download-text", "href"),
+        [dependencies.Input("activate_download", "n_clicks")],
     )
-    def download_dataset_callback(
-        dl_yaml_n_clicks, dl_json_n_clicks, dl_text_n_clicks, **kwargs
-    ):
-        if not kwargs["callback_context"].triggered:
-            raise no_update
-
-        triggered_id = (
-            kwargs["callback_context"].triggered[0]["prop_id"].split(".")[0]
+    def download_dataset_callback(_, **kwargs):
+        # The files are streamed by a dedicated view rather than passed through dash
+        data_reference = deserialize_path(
+            get_context(kwargs), "mm_dataset.data_reference"
         )
-        context = deserialize(kwargs["session_state"]["context"])
-        mm_dataset = context["mm_dataset"]
-        file_name = mm_dataset.name
-        yaml_dumper = YAMLDumper()
-        json_dumper = JSONDumper()
-        if triggered_id == "download-yaml":
-            return dict(
-                content=yaml_dumper.dumps(mm_dataset), filename=f"{file_name}.yaml"
-            )
-
-        elif triggered_id == "download-json":
-            return dict(
-                content=json_dumper.dumps(mm_dataset), filename=f"{file_name}.json"
-            )
-
-        elif triggered_id == "download-text":
-            return dict(
-                content=yaml_dumper.dumps(mm_dataset), filename=f"{file_name}.txt"
-            )
-
-        raise no_update
+        url = reverse(
+            "download_dataset",
+            kwargs={"dataset_id": int(data_reference.omero_object_id)},
+        )
+        return [f"{url}?format={f}" for f in ("yaml", "json", "text")]
 
 
 def register_update_kkm_table_callback(app):
@@ -333,7 +310,7 @@ def register_update_kkm_table_callback(app):
     def update_kkm_table_callback(pagination_value, **kwargs):
         try:
             page = int(pagination_value)
-            context = deserialize(kwargs["session_state"]["context"])
+            context = deserialize(get_context(kwargs))
             kkm = context["kkm"]
             # TODO: review how we process the tables here.
             table_km = load.get_km_mm_metrics_dataset(
@@ -379,7 +356,7 @@ def register_download_table_callback(app):
         triggered_id = (
             kwargs["callback_context"].triggered[0]["prop_id"].split(".")[0]
         )
-        context = deserialize(kwargs["session_state"]["context"])
+        context = deserialize(get_context(kwargs))
         table_km = load.get_km_mm_metrics_dataset(mm_dataset=context["mm_dataset"])
         kkm = context["kkm"]
         table_kkm = table_km.filter(["channel_name", *kkm])
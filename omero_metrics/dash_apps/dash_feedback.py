@@ -4,6 +4,7 @@ from dash import html
 from django_plotly_dash import DjangoDash
 
 import omero_metrics.dash_apps.dash_utils.omero_metrics_components as my_components
+from omero_metrics.tools.context_store import get_context
 
 warning_app = DjangoDash("WarningApp")
 
@@ -36,7 +37,7 @@ warning_app.layout = dmc.MantineProvider(
     [dash.dependencies.Input("input_void", "value")],
 )
 def callback_warning(*args, **kwargs):
-    message = kwargs["session_state"]["context"]["message"]
+    message = get_context(kwargs)["message"]
     return [message]
 
 
@@ -96,7 +97,7 @@ error_app.layout = dmc.MantineProvider(
     [dash.dependencies.Input("input_void_error", "value")],
 )
 def callback_error(*args, **kwargs):
-    context = kwargs["session_state"]["context"]
+    context = get_context(kwargs)
     message = context.get("message", "An unknown error occurred")
     traceback = context.get("traceback", "No traceback available")
     return [message, traceback]
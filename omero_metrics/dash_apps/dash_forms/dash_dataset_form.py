@@ -15,6 +15,7 @@ from omero_metrics.styles import (
     THEME,
 )
 from omero_metrics.tools import dash_forms_tools as dft
+from omero_metrics.tools.context_store import get_context
 from omero_metrics.views import run_analysis_view
 
 active = 0
@@ -259,9 +260,7 @@ dash_form_dataset.layout = dmc.MantineProvider(
     [dash.dependencies.Input("blank", "children")],
 )
 def update_setup(_, **kwargs):
-    input_parameters = kwargs["session_state"]["context"]["input_parameters"][
-        "input_parameters"
-    ]
+    input_parameters = get_context(kwargs)["input_parameters"]["input_parameters"]
     input_parameters_object = getattr(mm_schema, input_parameters["type"])
     input_parameters_mm = input_parameters_object(**input_parameters["fields"])
 
@@ -275,7 +274,7 @@ def update_setup(_, **kwargs):
     [dash.dependencies.Input("blank", "children")],
 )
 def update_sample(_, **kwargs):
-    sample = kwargs["session_state"]["context"]["input_parameters"]["sample"]
+    sample = get_context(kwargs)["input_parameters"]["sample"]
     mm_sample = getattr(mm_schema, sample["type"])
     mm_sample = mm_sample(**sample["fields"])
 
@@ -288,7 +287,7 @@ def update_sample(_, **kwargs):
     [dash.dependencies.Input("blank", "children")],
 )
 def list_images_multi_selector(_, **kwargs):
-    list_images = kwargs["session_state"]["context"]["list_images"]
+    list_images = get_context(kwargs)["list_images"]
     return list_images, [list_images[i]["value"] for i, _ in enumerate(list_images)]
 
 
@@ -400,13 +399,13 @@ dash_form_dataset.clientside_callback(
     prevent_initial_call=True,
 )
 def run_analysis(_, list_images, current, comment, **kwargs):
-    dataset_id = kwargs["session_state"]["context"]["dataset_id"]
+    dataset_id = get_context(kwargs)["dataset_id"]
     if current == 2:
         sleep(1)
-        input_parameters = kwargs["session_state"]["context"]["input_parameters"][
+        input_parameters = get_context(kwargs)["input_parameters"][
             "input_parameters"
         ]
-        sample = kwargs["session_state"]["context"]["input_parameters"]["sample"]
+        sample = get_context(kwargs)["input_parameters"]["sample"]
         try:
             input_parameters_object = getattr(mm_schema, input_parameters["type"])
             mm_input_parameters = input_parameters_object(
@@ -16,6 +16,7 @@ from omero_metrics.styles import (
     THEME,
 )
 from omero_metrics.tools import dash_forms_tools as dft
+from omero_metrics.tools.context_store import get_context
 
 # TODO: change the styles import
 
@@ -397,7 +398,7 @@ def save_config_dash(
     analysis_type = MAPPINGS[int(sample_type_selector)][2].__name__
     mm_sample = MAPPINGS[int(sample_type_selector)][0]
     mm_input_parameters = DATASET_TO_INPUT[analysis_type]
-    project_id = int(kwargs["session_state"]["context"]["project_id"])
+    project_id = int(get_context(kwargs)["project_id"])
     request = kwargs["request"]
     if clicked_data > 0 and current == 2:
         if dft.validate_form(sample_form) and dft.validate_form(input_form):
@@ -22,6 +22,8 @@ from omero_metrics.styles import (
     TABLE_STYLE,
     THEME,
 )
+from omero_metrics.tools.context_store import get_context
+from omero_metrics.tools.serializers import deserialize_path
 
 dashboard_name = "omero_group_dash"
 dash_app_group = DjangoDash(
@@ -273,7 +275,7 @@ dash_app_group.layout = dmc.MantineProvider(
     [dash.dependencies.Input("blank-input", "children")],
 )
 def update_date_range(*args, **kwargs):
-    df = kwargs["session_state"]["context"]["file_ann"]
+    df = deserialize_path(get_context(kwargs), "file_ann")
     min_date = df.Date.min()
     max_date = df.Date.max()
     return [min_date, max_date], min_date, max_date
@@ -284,9 +286,9 @@ def update_date_range(*args, **kwargs):
     dash.dependencies.Input("blank-input", "children"),
 )
 def render_content(*args, **kwargs):
-    group_name = kwargs["session_state"]["context"]["group_name"]
-    group_id = kwargs["session_state"]["context"]["group_id"]
-    group_description = kwargs["session_state"]["context"]["group_description"]
+    group_name = get_context(kwargs)["group_name"]
+    group_id = get_context(kwargs)["group_id"]
+    group_description = get_context(kwargs)["group_description"]
     return dmc.Stack(
         [
             dmc.Title("Microscope Information", c=THEME["primary"], order=4),
@@ -307,7 +309,7 @@ def render_content(*args, **kwargs):
     prevent_initial_call=True,
 )
 def load_table_project(dates, **kwargs):
-    file_ann = kwargs["session_state"]["context"]["file_ann"]
+    file_ann = deserialize_path(get_context(kwargs), "file_ann")
     if dates is not None:
         file_ann = file_ann[
             (file_ann["Date"].dt.date >= pd.to_datetime(dates[0]).date())
@@ -351,7 +353,7 @@ def load_table_project(dates, **kwargs):
 )
 def delete_all_callback(*args, **kwargs):
     triggered_button = kwargs["callback_context"].triggered[0]["prop_id"]
-    group_id = kwargs["session_state"]["context"]["group_id"]
+    group_id = get_context(kwargs)["group_id"]
     request = kwargs["request"]
     opened = not args[3]
     if triggered_button == "modal-submit-button.n_clicks" and args[0] > 0:
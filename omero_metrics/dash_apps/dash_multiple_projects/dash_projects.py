@@ -5,6 +5,7 @@ from django_plotly_dash import DjangoDash
 
 import omero_metrics.dash_apps.dash_utils.omero_metrics_components as my_components
 from omero_metrics.styles import CARD_STYLE1
+from omero_metrics.tools.context_store import get_context
 
 # Initialize the Dash app
 dashboard_name = "omero_multiple_projects"
@@ -36,10 +37,8 @@ omero_multiple_projects.layout = dmc.MantineProvider(
     [dash.dependencies.Input("input_void", "value")],
 )
 def kkm_tables_projects(*args, **kwargs):
-    if kwargs["session_state"]["context"]:
-        data = kwargs["session_state"]["context"]
-        print(data)
-        print(kwargs["session_state"]["context"])
+    data = get_context(kwargs)
+    if data:
         div_data = []
         for project_id in data:
             if data[project_id]:
@@ -7,8 +7,8 @@ import dash
 import dash_mantine_components as dmc
 import pandas as pd
 from dash import html
+from django.urls import reverse
 from django_plotly_dash import DjangoDash
-from linkml_runtime.dumpers import JSONDumper, YAMLDumper
 from microscopemetrics_schema import datamodel as mm_schema
 
 import omero_metrics.dash_apps.dash_utils.omero_metrics_components as my_components
@@ -27,7 +27,8 @@ from omero_metrics.styles import (
     THEME,
 )
 from omero_metrics.tools import dash_forms_tools as dft
-from omero_metrics.tools.serializers import deserialize
+from omero_metrics.tools.context_store import get_context
+from omero_metrics.tools.serializers import deserialize, deserialize_path
 
 # Initialize the Dash app
 dashboard_name = "omero_project_dash"
@@ -342,7 +343,7 @@ omero_project_dash.layout = dmc.MantineProvider(
 )
 def update_dropdown(*args, **kwargs):
     try:
-        context = deserialize(kwargs["session_state"]["context"])
+        context = deserialize(get_context(kwargs))
         kkm = context["kkm"]
         kkm = [k.replace("_", " ").title() for k in kkm]
 
@@ -384,9 +385,7 @@ def update_dropdown(*args, **kwargs):
 )
 def check_data(*args, **kwargs):
     try:
-        data = deserialize(kwargs["session_state"]["context"])[
-            "key_measurements_by_kkm"
-        ]
+        data = deserialize_path(get_context(kwargs), "key_measurements_by_kkm")
         # FIXME: This expression is odd in any case this returns no update
         if not data:
             return dash.no_update
@@ -422,7 +421,7 @@ def check_data(*args, **kwargs):
 )
 def update_table(measurement, dates_range, **kwargs):
     try:
-        context = deserialize(kwargs["session_state"]["context"])
+        context = deserialize(get_context(kwargs))
         key_measurements_by_kkm = context["key_measurements_by_kkm"]
         threshold = context["thresholds"]
         kkm = context["kkm"]
@@ -476,7 +475,7 @@ def update_table(measurement, dates_range, **kwargs):
 def update_project_view(clicked_data, page, **kwargs):
     try:
         if clicked_data:
-            context = deserialize(kwargs["session_state"]["context"])
+            context = deserialize(get_context(kwargs))
             key_measurements_by_dataset_id = context[
                 "key_measurements_by_dataset_id"
             ]
@@ -508,7 +507,7 @@ def update_project_view(clicked_data, page, **kwargs):
     [dash.dependencies.Input("blank-input", "children")],
 )
 def update_modal(*args, **kwargs):
-    context = deserialize(kwargs["session_state"]["context"])
+    context = deserialize(get_context(kwargs))
     sample = context["sample"]
     mm_sample = getattr(mm_schema, sample["type"])
     mm_sample = mm_sample(**sample["fields"])
@@ -571,7 +570,7 @@ omero_project_dash.clientside_callback(
     prevent_initial_call=True,
 )
 def update_config_project(submit_click, sample_form, input_form, **kwargs):
-    context = deserialize(kwargs["session_state"]["context"])
+    context = deserialize(get_context(kwargs))
     project_id = int(context["project_id"])
     request = kwargs["request"]
     sample = context["sample"]
@@ -623,7 +622,7 @@ def update_config_project(submit_click, sample_form, input_form, **kwargs):
 )
 def update_thresholds(*args, **kwargs):
     try:
-        kkm = deserialize(kwargs["session_state"]["context"])["kkm"]
+        kkm = deserialize_path(get_context(kwargs), "kkm")
         # TODO: Move to kkm titles if and once implemented
         kkm = [k.replace("_", " ").title() for k in kkm]
         data = [{"value": f"{i}", "label": f"{k}"} for i, k in enumerate(kkm)]
@@ -649,7 +648,7 @@ def update_heart(n, **kwargs):
 )
 def update_thresholds_controls(*args, **kwargs):
     try:
-        context = deserialize(kwargs["session_state"]["context"])
+        context = deserialize(get_context(kwargs))
         kkm = context["kkm"]
         threshold = context["thresholds"]
         if threshold:
@@ -721,7 +720,7 @@ def update_thresholds_controls(*args, **kwargs):
 )
 def threshold_callback1(*args, **kwargs):
     try:
-        context = deserialize(kwargs["session_state"]["context"])
+        context = deserialize(get_context(kwargs))
         kkm = context["kkm"]
         output = get_accordion_data(args[1], kkm)
         request = kwargs["request"]
@@ -789,7 +788,7 @@ def get_accordion_data(accordion_state, kkm):
 def delete_project(*args, **kwargs):
     try:
         triggered_button = kwargs["callback_context"].triggered[0]["prop_id"]
-        project_id = deserialize(kwargs["session_state"]["context"])["project_id"]
+        project_id = deserialize_path(get_context(kwargs), "project_id")
         request = kwargs["request"]
         opened = not args[3]
         if triggered_button == "delete-modal-submit-button.n_clicks" and args[0] > 0:
@@ -808,48 +807,19 @@ def delete_project(*args, **kwargs):
 
 
 @omero_project_dash.expanded_callback(
-    dash.dependencies.Output("download", "data"),
-    [
-        dash.dependencies.Input("download-yaml", "n_clicks"),
-        dash.dependencies.Input("download-json", "n_clicks"),
-        dash.dependencies.Input("download-text", "n_clicks"),
-    ],
-    prevent_initial_call=True,
+    dash.dependencies.Output("download-yaml", "href"),
+    dash.dependencies.Output("download-json", "href"),
+    dash.dependencies.Output("download-text", "href"),
+    [dash.dependencies.Input("activate_download", "n_clicks")],
 )
 def download_project_data(*args, **kwargs):
+    # The files are streamed by a dedicated view rather than passed through dash
     try:
-        if not kwargs["callback_context"].triggered:
-            raise dash.no_update
-
-        triggered_id = (
-            kwargs["callback_context"].triggered[0]["prop_id"].split(".")[0]
-        )
-        context = deserialize(kwargs["session_state"]["context"])
-        mm_datasets = context["mm_datasets"]
-        file_name = context["project_name"]
-        yaml_dumper = YAMLDumper()
-        json_dumper = JSONDumper()
-        if triggered_id == "download-yaml":
-            return dict(
-                content=yaml_dumper.dumps(mm_datasets),
-                filename=f"{file_name}.yaml",
-            )
-
-        elif triggered_id == "download-json":
-            return dict(
-                content=json_dumper.dumps(mm_datasets),
-                filename=f"{file_name}.json",
-            )
-
-        elif triggered_id == "download-text":
-            return dict(
-                content=yaml_dumper.dumps(mm_datasets),
-                filename=f"{file_name}.txt",
-            )
-
-        raise dash.no_update
+        project_id = deserialize_path(get_context(kwargs), "project_id")
+        url = reverse("download_project", kwargs={"project_id": int(project_id)})
+        return [f"{url}?format={f}" for f in ("yaml", "json", "text")]
     except Exception as e:
-        return dash.no_update
+        return dash.no_update, dash.no_update, dash.no_update
 
 
 omero_project_dash.clientside_callback(
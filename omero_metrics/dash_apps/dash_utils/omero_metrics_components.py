@@ -152,7 +152,6 @@ download_group = dmc.Group(
             ],
             trigger="click",
         ),
-        dcc.Download(id="download"),
     ]
 )
 
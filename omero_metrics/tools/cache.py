@@ -0,0 +1,484 @@
+"""
+Caching utilities for omero-metrics.
+Keeps data that is expensive to fetch from OMERO close to the web worker.
+"""
+
+import contextlib
+import copy
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from django.conf import settings
+from microscopemetrics_schema.datamodel import microscopemetrics_schema as mm_schema
+from omero.gateway import FileAnnotationWrapper, ImageWrapper
+
+logger = logging.getLogger(__name__)
+
+# Parent directory of the disk caches. Overridden by the OMERO_METRICS_CACHE_DIR setting
+CACHE_DIR = os.path.join(tempfile.gettempdir(), f"omero_metrics_{os.getuid()}")
+PIXEL_CACHE_ENABLED = True
+PIXEL_CACHE_MAX_BYTES = 2 * 1024**3
+DATASET_CACHE_MAX_ENTRIES = 64
+DATASET_CACHE_TTL = 300
+# Default of the SESSION_COOKIE_AGE Django setting
+SESSION_COOKIE_AGE = 14 * 24 * 3600
+BLOB_STORE_MAX_BYTES = 4 * 1024**3
+BLOB_STORE_GC_INTERVAL = 3600
+CONTEXT_CACHE_MAX_BYTES = 256 * 1024**2
+
+
+def get_setting(name: str, default):
+    """Returns a Django setting, or default when it is not set or Django is not configured"""
+    if not settings.configured:
+        return default
+    return getattr(settings, name, default)
+
+
+def get_session_age() -> int:
+    """Returns the age of the Django sessions in seconds"""
+    return int(get_setting("SESSION_COOKIE_AGE", SESSION_COOKIE_AGE))
+
+
+def make_private_dir(path: str) -> str:
+    """Creates a directory only accessible to the current user and returns its path.
+    Raises a PermissionError if the directory exists and belongs to another user.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if os.stat(path).st_uid != os.getuid():
+        raise PermissionError(f"Cache directory {path} belongs to another user")
+    os.chmod(path, 0o700)
+    return path
+
+
+def get_cache_dir(name: str) -> str:
+    """Returns the private directory of the disk cache called name"""
+    cache_dir = make_private_dir(get_setting("OMERO_METRICS_CACHE_DIR", CACHE_DIR))
+    return make_private_dir(os.path.join(cache_dir, name))
+
+
+def _get_pixels_update_event_id(image: ImageWrapper) -> int:
+    """Get the id of the last event that modified the pixels of an image"""
+    update_event = image.getPrimaryPixels()._obj.getDetails().getUpdateEvent()
+    if update_event is None or update_event.getId() is None:
+        return 0
+    return update_event.getId().getValue()
+
+
+class PixelCache:
+    """A disk-backed cache of image intensities.
+    Arrays are stored as .npy files keyed by image id and the update event of the
+    pixels object, and they are memory-mapped on read. When the total size of the
+    cache exceeds max_bytes, the least recently used arrays are evicted.
+    Unless given, the settings are read from OMERO_METRICS_PIXEL_CACHE_ENABLED,
+    OMERO_METRICS_PIXEL_CACHE_DIR and OMERO_METRICS_PIXEL_CACHE_MAX_BYTES.
+    A disabled cache never stores anything.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = None,
+        max_bytes: int = None,
+        enabled: bool = None,
+    ):
+        if enabled is None:
+            enabled = get_setting(
+                "OMERO_METRICS_PIXEL_CACHE_ENABLED", PIXEL_CACHE_ENABLED
+            )
+        if max_bytes is None:
+            max_bytes = get_setting(
+                "OMERO_METRICS_PIXEL_CACHE_MAX_BYTES", PIXEL_CACHE_MAX_BYTES
+            )
+        self.enabled = bool(enabled)
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self.cache_dir = None
+        if self.enabled:
+            cache_dir = cache_dir or get_setting(
+                "OMERO_METRICS_PIXEL_CACHE_DIR", None
+            )
+            self.cache_dir = (
+                make_private_dir(cache_dir) if cache_dir else get_cache_dir("pixels")
+            )
+
+    def _path(self, image_id: int, update_event_id: int) -> str:
+        return os.path.join(self.cache_dir, f"{image_id}_{update_event_id}.npy")
+
+    def _key(self, image: ImageWrapper) -> tuple[int, int]:
+        return image.getId(), _get_pixels_update_event_id(image)
+
+    def get(self, image: ImageWrapper) -> Optional[np.ndarray]:
+        """Returns the cached intensities of the image as a copy-on-write memmap or None"""
+        if not self.enabled:
+            return None
+        path = self._path(*self._key(image))
+        try:
+            array = np.load(path, mmap_mode="c")
+            # Touching the file marks it as recently used for the eviction
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        logger.debug(f"Pixel cache hit for image {image.getId()}")
+        return array
+
+    def put(self, image: ImageWrapper, array: np.ndarray) -> np.ndarray:
+        """Stores the intensities of the image and returns them memory-mapped from disk"""
+        if not self.enabled or array.nbytes > self.max_bytes:
+            return array
+        image_id, update_event_id = self._key(image)
+        path = self._path(image_id, update_event_id)
+        with self._lock:
+            # Older versions of the same image will never be requested again
+            self._remove(image_id)
+            with tempfile.NamedTemporaryFile(
+                dir=self.cache_dir, suffix=".npy.tmp", delete=False
+            ) as f:
+                np.save(f, array)
+            os.replace(f.name, path)
+            self._evict()
+        return np.load(path, mmap_mode="c")
+
+    def clear(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            for entry in self._entries():
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(entry.path)
+
+    def _entries(self) -> list:
+        try:
+            return [e for e in os.scandir(self.cache_dir) if e.name.endswith(".npy")]
+        except FileNotFoundError:
+            return []
+
+    def _remove(self, image_id: int):
+        for entry in self._entries():
+            if entry.name.split("_")[0] == str(image_id):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(entry.path)
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime)
+        total_bytes = sum(e.stat().st_size for e in entries)
+        while entries and total_bytes > self.max_bytes:
+            entry = entries.pop(0)
+            total_bytes -= entry.stat().st_size
+            logger.debug(f"Evicting {entry.name} from the pixel cache")
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(entry.path)
+
+
+def _get_file_hash(file_ann: FileAnnotationWrapper) -> str:
+    """Get the hash of the file of a file annotation, or its size if it was not hashed"""
+    original_file = file_ann.getFile()
+    file_hash = original_file.getHash()
+    if file_hash is None:
+        return str(original_file.getSize())
+    return file_hash
+
+
+class DatasetCache:
+    """An in-memory cache of the datasets parsed from file annotations.
+    Entries are keyed by file annotation id and file hash. They expire after ttl
+    seconds, and beyond max_entries the least recently used are evicted.
+    Copies are stored and returned so that callers may modify the datasets freely.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DATASET_CACHE_MAX_ENTRIES,
+        ttl: float = DATASET_CACHE_TTL,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (expiry time, OMERO dataset id, parsed dataset)
+        self._entries = OrderedDict()
+
+    def _key(self, file_ann: FileAnnotationWrapper) -> tuple[int, str]:
+        return file_ann.getId(), _get_file_hash(file_ann)
+
+    def get(
+        self, file_ann: FileAnnotationWrapper
+    ) -> Optional[mm_schema.MetricsDataset]:
+        """Returns a copy of the dataset parsed from the file annotation or None"""
+        key = self._key(file_ann)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expiry, _, mm_dataset = entry
+            if expiry < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        logger.debug(f"Dataset cache hit for file annotation {file_ann.getId()}")
+        return copy.deepcopy(mm_dataset)
+
+    def put(
+        self,
+        file_ann: FileAnnotationWrapper,
+        dataset_id: int,
+        mm_dataset: mm_schema.MetricsDataset,
+    ):
+        """Stores a copy of the dataset parsed from the file annotation"""
+        key = self._key(file_ann)
+        entry = (time.monotonic() + self.ttl, dataset_id, copy.deepcopy(mm_dataset))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, dataset_id: int):
+        """Removes the entries parsed from the file annotations of an OMERO dataset"""
+        with self._lock:
+            for key in [
+                k for k, (_, d_id, _) in self._entries.items() if d_id == dataset_id
+            ]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class BlobStore:
+    """A disk-backed content-addressed store of arrays.
+    Arrays are saved as .npy files named after the hash of their content and they
+    are memory-mapped read-only on read. Blobs live as long as the Django sessions
+    referencing them: those that were not used for max_age seconds are garbage collected.
+    Beyond max_bytes, the least recently used blobs are evicted. Collection runs on
+    reads and writes, at most every gc_interval seconds.
+    Unless given, max_age is SESSION_COOKIE_AGE and the directory and size are read from
+    the OMERO_METRICS_BLOB_STORE_DIR and OMERO_METRICS_BLOB_STORE_MAX_BYTES settings.
+    """
+
+    def __init__(
+        self,
+        store_dir: str = None,
+        max_age: float = None,
+        max_bytes: int = None,
+        gc_interval: float = BLOB_STORE_GC_INTERVAL,
+    ):
+        store_dir = store_dir or get_setting("OMERO_METRICS_BLOB_STORE_DIR", None)
+        self.store_dir = (
+            make_private_dir(store_dir) if store_dir else get_cache_dir("blobs")
+        )
+        self.max_age = get_session_age() if max_age is None else max_age
+        if max_bytes is None:
+            max_bytes = get_setting(
+                "OMERO_METRICS_BLOB_STORE_MAX_BYTES", BLOB_STORE_MAX_BYTES
+            )
+        self.max_bytes = int(max_bytes)
+        self.gc_interval = gc_interval
+        self._last_gc = 0.0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        if not re.fullmatch(r"[0-9a-f]{64}", key):
+            raise ValueError(f"Invalid blob key {key}")
+        return os.path.join(self.store_dir, f"{key}.npy")
+
+    def put(self, array: np.ndarray) -> str:
+        """Stores an array and returns its key"""
+        array = np.ascontiguousarray(array)
+        digest = hashlib.sha256(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(array.data)
+        key = digest.hexdigest()
+        path = self._path(key)
+        with self._lock:
+            try:
+                # Same content, same blob. Touching it extends its life
+                os.utime(path)
+            except FileNotFoundError:
+                with tempfile.NamedTemporaryFile(
+                    dir=self.store_dir, suffix=".npy.tmp", delete=False
+                ) as f:
+                    np.save(f, array)
+                os.replace(f.name, path)
+        self._collect()
+        return key
+
+    def get(self, key: str) -> np.ndarray:
+        """Returns the array stored under key as a read-only memmap"""
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except FileNotFoundError:
+            raise KeyError(f"Blob {key} is not in the store. It may have expired")
+        self._collect()
+        return array
+
+    def has(self, key: str) -> bool:
+        """Returns whether a blob is in the store, extending its life if it is"""
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _collect(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_gc < self.gc_interval:
+                return
+            self._last_gc = now
+        try:
+            entries = [
+                (e, e.stat()) for e in os.scandir(self.store_dir) if e.is_file()
+            ]
+        except FileNotFoundError:
+            return
+        entries.sort(key=lambda e: e[1].st_mtime)
+        total_bytes = sum(stat.st_size for _, stat in entries)
+        for entry, stat in entries:
+            expired = now - stat.st_mtime > self.max_age
+            if not expired and total_bytes <= self.max_bytes:
+                break
+            logger.debug(f"Removing blob {entry.name}")
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(entry.path)
+            total_bytes -= stat.st_size
+
+
+class ContextCache:
+    """An in-memory cache of deserialized Dash contexts.
+    Entries are keyed by the content hash stamped by serializers.serialize. When the
+    total size of the entries exceeds max_bytes, the least recently used are evicted.
+    """
+
+    def __init__(self, max_bytes: int = CONTEXT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+        # key -> (size, value)
+        self._entries = OrderedDict()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, value, size: int):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[0]
+            self._entries[key] = (size, value)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                self._total_bytes -= self._entries.popitem(last=False)[1][0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+
+class SnapshotCache:
+    """A disk-backed cache of the contexts built from the analysis of a dataset.
+    Snapshots are JSON serializable and kept as JSON files in a private directory,
+    OMERO_METRICS_SNAPSHOT_CACHE_DIR if set. They are keyed by the id and the file hash of
+    the analysis file annotation so they are never served for another analysis.
+    They expire max_age seconds after they were built.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = None,
+        max_age: float = None,
+    ):
+        cache_dir = cache_dir or get_setting(
+            "OMERO_METRICS_SNAPSHOT_CACHE_DIR", None
+        )
+        self.cache_dir = (
+            make_private_dir(cache_dir) if cache_dir else get_cache_dir("snapshots")
+        )
+        # Snapshots reference arrays in the blob store so they must expire well before them
+        self.max_age = get_session_age() // 2 if max_age is None else max_age
+
+    def _path(self, file_ann: FileAnnotationWrapper) -> str:
+        key = f"{file_ann.getId()}:{_get_file_hash(file_ann)}"
+        return os.path.join(
+            self.cache_dir, f"{hashlib.sha256(key.encode()).hexdigest()}.json"
+        )
+
+    def get(self, file_ann: FileAnnotationWrapper):
+        """Returns the snapshot built from the analysis in file_ann or None"""
+        path = self._path(file_ann)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.max_age:
+                return None
+            with open(path, "rb") as f:
+                snapshot = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        logger.debug(f"Snapshot cache hit for file annotation {file_ann.getId()}")
+        return snapshot
+
+    def put(self, file_ann: FileAnnotationWrapper, snapshot):
+        with tempfile.NamedTemporaryFile(
+            mode="w", dir=self.cache_dir, suffix=".json.tmp", delete=False
+        ) as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        os.replace(f.name, self._path(file_ann))
+        self._collect()
+
+    def _collect(self):
+        now = time.time()
+        for entry in os.scandir(self.cache_dir):
+            with contextlib.suppress(FileNotFoundError):
+                if now - entry.stat().st_mtime > self.max_age:
+                    os.remove(entry.path)
+
+
+# The caches of the process are created on first use, once the Django settings are loaded.
+# OMEROMetricsConfig.ready creates them at start up.
+@functools.lru_cache(maxsize=None)
+def get_pixel_cache() -> PixelCache:
+    return PixelCache()
+
+
+@functools.lru_cache(maxsize=None)
+def get_dataset_cache() -> DatasetCache:
+    return DatasetCache()
+
+
+@functools.lru_cache(maxsize=None)
+def get_blob_store() -> BlobStore:
+    return BlobStore()
+
+
+@functools.lru_cache(maxsize=None)
+def get_context_cache() -> ContextCache:
+    return ContextCache()
+
+
+@functools.lru_cache(maxsize=None)
+def get_context_snapshots() -> SnapshotCache:
+    return SnapshotCache()
+
+
+CACHE_ACCESSORS = [
+    get_pixel_cache,
+    get_dataset_cache,
+    get_blob_store,
+    get_context_cache,
+    get_context_snapshots,
+]
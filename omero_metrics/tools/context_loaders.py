@@ -4,37 +4,68 @@ from datetime import datetime
 import numpy as np
 import pandas as pd
 
-from omero_metrics.tools import load
+from omero_metrics.tools import load, omero_tools
 from omero_metrics.tools.data_type import KKM_MAPPINGS
 from omero_metrics.tools.serializers import serialize
 
+# Longest edge of the planes put in the dataset contexts.
+# Overridden by the OMERO_METRICS_CONTEXT_MAX_EDGE setting
+CONTEXT_MAX_EDGE = 512
 
-def concatenate_images(images: list):
-    list_images = []
+
+def downsample_plane(plane: np.ndarray, max_edge: int = None) -> np.ndarray:
+    """Downsample a 2D plane through a block-mean pyramid until its longest edge is at
+    most max_edge. Every level halves the axes that are still larger than their target,
+    max_edge scaled by the aspect ratio, dropping the last row or column of odd edges.
+    """
+    max_edge = max_edge or CONTEXT_MAX_EDGE
+    plane = plane.astype(np.float32)
+    scale = min(max_edge / max(plane.shape), 1)
+    target_h, target_w = (max(int(np.ceil(s * scale)), 1) for s in plane.shape)
+    while plane.shape[0] > target_h or plane.shape[1] > target_w:
+        fy = 2 if plane.shape[0] > target_h else 1
+        fx = 2 if plane.shape[1] > target_w else 1
+        h, w = plane.shape[0] // fy * fy, plane.shape[1] // fx * fx
+        plane = plane[:h, :w].reshape(h // fy, fy, w // fx, fx).mean(axis=(1, 3))
+    return plane
+
+
+def load_first_planes(conn, images: list, max_edge: int = None):
+    """Get the first plane of every channel of the images, downsampled to max_edge.
+    Only the first planes are fetched from OMERO.
+    The full resolution images remain available through the image views.
+    """
+    list_planes = []
     list_channels = []
     for mm_image in images:
-        image = mm_image.array_data
-        result = [image[:, :, :, :, i] for i in range(image.shape[4])]
-        channels = [c.name for c in mm_image.channel_series.channels]
-        list_images.extend(result)
-        list_channels.extend(channels)
-    return list_images, list_channels
+        omero_image = omero_tools.get_omero_obj_from_mm_obj(conn, mm_image)
+        planes = load.LazyImageArray(omero_image)[0, 0]
+        list_planes.extend(
+            downsample_plane(planes[:, :, c], max_edge)
+            for c in range(planes.shape[-1])
+        )
+        list_channels.extend(c.name for c in mm_image.channel_series.channels)
+    return list_planes, list_channels
 
 
 ## Image context loaders
 def FieldIlluminationDataset_input_data_Image(im):
-    im.mm_image = load.load_image(im.omero_image, load_array=True)
+    im.mm_image = load.load_image(im.omero_image, load_array=True, lazy=True)
+    # The image view only displays the first plane of every channel
+    im.mm_image.array_data = im.mm_image.array_data[:1, :1]
     context = {
         "image_index": im.image_index,
         "mm_image": im.mm_image,
         "mm_dataset": im.dataset_manager.mm_dataset,
     }
-    im.context = serialize(context)
+    im.context = serialize(context, codec="zlib", narrow_dtype=True)
 
 
 def PSFBeadsDataset_input_data_Image(im):
-    im.mm_image = load.load_image(im.omero_image, load_array=True)
-    mip_z = np.max(im.mm_image.array_data[0, ...], axis=0)
+    im.mm_image = load.load_image(im.omero_image, load_array=True, lazy=True)
+    # Only the first time point is used. The bead crops and the projection are taken from it
+    im.mm_image.array_data = im.mm_image.array_data[:1]
+    mip_z = im.mm_image.array_data[0].max(axis=0)
     bead_properties = load.load_table_mm_metrics(
         im.dataset_manager.mm_dataset.output["bead_properties"]
     )
@@ -105,18 +136,19 @@ def PSFBeadsDataset_input_data_Image(im):
         "beads_properties": image_bead_properties,
         "beads_array": beads_array,
     }
-    im.context = serialize(context)
+    im.context = serialize(context, codec="zlib", narrow_dtype=True)
 
 
 def PSFBeadsDataset_output_AveragePSF(im):
-    im.mm_image = load.load_image(im.omero_image, load_array=True)
-
+    im.mm_image = load.load_image(im.omero_image, load_array=False)
+    # Projections are arranged zctyx with the projected axis of size 1
+    projections = omero_tools.get_image_projections(
+        im.omero_image, projection="max", axes=("z", "y", "x"), t_range=0
+    )
     mips = {
-        "x": np.flipud(
-            np.transpose(np.max(im.mm_image.array_data[0, ...], axis=2), (1, 0, 2))
-        ),
-        "y": np.max(im.mm_image.array_data[0, ...], axis=1),
-        "z": np.flipud(np.max(im.mm_image.array_data[0, ...], axis=0)),
+        "x": np.flipud(projections["x"][:, :, 0, :, 0].transpose((2, 0, 1))),
+        "y": projections["y"][:, :, 0, 0, :].transpose((0, 2, 1)),
+        "z": np.flipud(projections["z"][0, :, 0].transpose((1, 2, 0))),
     }
     mips = {a: np.sqrt(mip) for a, mip in mips.items()}
 
@@ -127,14 +159,15 @@ def PSFBeadsDataset_output_AveragePSF(im):
         "mips": mips,
         "kkm": im.dataset_manager.kkm,
     }
-    im.context = serialize(context)
+    # The square roots of the projections have no integer dtype to be narrowed to
+    im.context = serialize(context, codec="zlib")
 
 
 ## Dataset context loaders
 def FieldIlluminationDataset(dm):
-    dm.load_data(load_images=True, force_reload=True)
-    list_images, list_channels = concatenate_images(
-        dm.mm_dataset.input_data.field_illumination_images
+    dm.load_data(load_images=False, force_reload=True)
+    list_images, list_channels = load_first_planes(
+        dm._conn, dm.mm_dataset.input_data.field_illumination_images
     )
     context = {
         "mm_dataset": dm.mm_dataset,
@@ -142,7 +175,7 @@ def FieldIlluminationDataset(dm):
         "channel_names": list_channels,
         "kkm": dm.kkm,
     }
-    dm.context = serialize(context)
+    dm.context = serialize(context, codec="zlib", narrow_dtype=True)
 
 
 def PSFBeadsDataset(dm):
@@ -155,7 +188,7 @@ def PSFBeadsDataset(dm):
 
 
 def EmptyMetricsDatasetCollection(pm):
-    pm.load_data()
+    pm.load_data(output_fields=pm.output_fields)
     pm.load_input_config()
     pm.load_thresholds()
     context = {
@@ -169,7 +202,7 @@ def EmptyMetricsDatasetCollection(pm):
 
 
 def HarmonizedMetricsDatasetCollection(pm):
-    pm.load_data()
+    pm.load_data(output_fields=pm.output_fields)
     pm.load_input_config()
     pm.load_thresholds()
     dates = []
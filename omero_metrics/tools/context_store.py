@@ -0,0 +1,258 @@
+"""
+Server-side store of the contexts of the Dash apps.
+The views keep only a token in the Django session so that session writes stay small
+whatever the size of the context. The callbacks resolve the context from the token.
+Contexts must be JSON serializable, as they were when kept in the session.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from typing import Any
+
+from omero_metrics.tools.cache import (
+    BLOB_STORE_GC_INTERVAL,
+    get_cache_dir,
+    get_session_age,
+    get_setting,
+    make_private_dir,
+)
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_STORE_MAX_ENTRIES = 128
+CONTEXT_STORE_MAX_BYTES = 1024**3
+CONTEXT_STORE_GC_INTERVAL = BLOB_STORE_GC_INTERVAL
+
+# Key of the token stored in the session in place of the context
+TOKEN_MARKER = "__context_token__"
+# Key of the source the context can be rebuilt from, stored next to the token
+SOURCE_MARKER = "__context_source__"
+
+
+class ContextStore:
+    """Base class of the context stores.
+    Contexts are stored under a random token and must not be modified once stored.
+    """
+
+    def put(self, context: Any) -> str:
+        """Stores a context and returns its token"""
+        token = secrets.token_hex(16)
+        self._put(token, context)
+        return token
+
+    def get(self, token: str) -> Any:
+        """Returns the context stored under token. Raises a KeyError if there is none"""
+        raise NotImplementedError
+
+    def delete(self, token: str):
+        """Removes the context stored under token, if any"""
+        raise NotImplementedError
+
+    def _put(self, token: str, context: Any):
+        raise NotImplementedError
+
+
+class MemoryContextStore(ContextStore):
+    """Keeps the contexts in memory, evicting the least recently used beyond max_entries.
+    The contexts are only visible to the process that stored them so this store only
+    suits single process deployments.
+    """
+
+    def __init__(self, max_entries: int = CONTEXT_STORE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, token: str) -> Any:
+        with self._lock:
+            context = self._entries[token]
+            self._entries.move_to_end(token)
+        return context
+
+    def delete(self, token: str):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def _put(self, token: str, context: Any):
+        with self._lock:
+            self._entries[token] = context
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class FileContextStore(ContextStore):
+    """Keeps the contexts as JSON files shared by all the processes of the host.
+    The files are kept in a private directory, OMERO_METRICS_CONTEXT_STORE_DIR if set.
+    The last contexts used are also kept in memory. Contexts live as long as the
+    sessions referencing them: files that were not read for max_age seconds are
+    garbage collected and beyond max_bytes the least recently used are evicted.
+    Collection runs at most every gc_interval seconds.
+    """
+
+    def __init__(
+        self,
+        store_dir: str = None,
+        max_age: float = None,
+        max_bytes: int = None,
+        gc_interval: float = CONTEXT_STORE_GC_INTERVAL,
+        max_entries: int = CONTEXT_STORE_MAX_ENTRIES,
+    ):
+        store_dir = store_dir or get_setting("OMERO_METRICS_CONTEXT_STORE_DIR", None)
+        self.store_dir = (
+            make_private_dir(store_dir) if store_dir else get_cache_dir("contexts")
+        )
+        self.max_age = get_session_age() if max_age is None else max_age
+        if max_bytes is None:
+            max_bytes = get_setting(
+                "OMERO_METRICS_CONTEXT_STORE_MAX_BYTES", CONTEXT_STORE_MAX_BYTES
+            )
+        self.max_bytes = int(max_bytes)
+        self.gc_interval = gc_interval
+        self._memory = MemoryContextStore(max_entries)
+        self._last_gc = 0.0
+        self._lock = threading.Lock()
+
+    def _path(self, token: str) -> str:
+        if not re.fullmatch(r"[0-9a-f]{32}", token):
+            raise KeyError(f"Invalid context token {token}")
+        return os.path.join(self.store_dir, f"{token}.json")
+
+    def get(self, token: str) -> Any:
+        path = self._path(token)
+        with contextlib.suppress(KeyError):
+            context = self._memory.get(token)
+            with contextlib.suppress(FileNotFoundError):
+                os.utime(path)
+            return context
+        try:
+            with open(path, "rb") as f:
+                context = json.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            raise KeyError(
+                f"Context {token} is not in the store. It may have expired"
+            )
+        self._memory._put(token, context)
+        return context
+
+    def delete(self, token: str):
+        self._memory.delete(token)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._path(token))
+
+    def _put(self, token: str, context: Any):
+        with tempfile.NamedTemporaryFile(
+            mode="w", dir=self.store_dir, suffix=".json.tmp", delete=False
+        ) as f:
+            json.dump(context, f, separators=(",", ":"))
+        os.replace(f.name, self._path(token))
+        self._memory._put(token, context)
+        self._collect()
+
+    def _collect(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_gc < self.gc_interval:
+                return
+            self._last_gc = now
+        try:
+            entries = [
+                (e, e.stat()) for e in os.scandir(self.store_dir) if e.is_file()
+            ]
+        except FileNotFoundError:
+            return
+        entries.sort(key=lambda e: e[1].st_mtime)
+        total_bytes = sum(stat.st_size for _, stat in entries)
+        for entry, stat in entries:
+            if now - stat.st_mtime <= self.max_age and total_bytes <= self.max_bytes:
+                break
+            logger.debug(f"Removing context {entry.name}")
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(entry.path)
+            total_bytes -= stat.st_size
+
+
+CONTEXT_STORES = {
+    "memory": MemoryContextStore,
+    "file": FileContextStore,
+}
+
+_context_store = None
+_context_store_lock = threading.Lock()
+
+
+def get_context_store() -> ContextStore:
+    """Returns the context store. Unless one was set, e.g. by OMEROMetricsConfig.ready
+    from the OMERO_METRICS_CONTEXT_STORE setting, a FileContextStore is created.
+    """
+    global _context_store
+    with _context_store_lock:
+        if _context_store is None:
+            _context_store = FileContextStore()
+        return _context_store
+
+
+def set_context_store(store: ContextStore):
+    """Replaces the context store, e.g. by one backed by a shared cache server"""
+    global _context_store
+    with _context_store_lock:
+        _context_store = store
+
+
+def store_context(context: Any, replaces: Any = None, source: dict = None) -> dict:
+    """Stores a context and returns the token to keep in the session in its place.
+    replaces is the context the token replaces in the session. If it was stored, it is
+    removed from the store as no session references it anymore.
+    source describes how views.rebuild_context can build the context again, e.g.
+    {"kind": "dataset", "id": 1}, if it is evicted while the page is still open.
+    """
+    if isinstance(replaces, dict) and TOKEN_MARKER in replaces:
+        with contextlib.suppress(KeyError):
+            get_context_store().delete(replaces[TOKEN_MARKER])
+    return {TOKEN_MARKER: get_context_store().put(context), SOURCE_MARKER: source}
+
+
+def get_context(kwargs: dict) -> Any:
+    """Returns the context of a Dash callback from the session state in its kwargs.
+    Contexts that were put in the session without going through the store are returned as is.
+    Contexts missing from the store, e.g. expired or evicted while the page was open, are
+    rebuilt from their source. If that is not possible, an error context is returned.
+    """
+    session_state = kwargs["session_state"]
+    context = session_state["context"]
+    if not isinstance(context, dict) or TOKEN_MARKER not in context:
+        return context
+    try:
+        return get_context_store().get(context[TOKEN_MARKER])
+    except KeyError as e:
+        logger.warning(f"{e}. Rebuilding it")
+
+    source = context.get(SOURCE_MARKER)
+    try:
+        if source is None:
+            raise ValueError("The context has no source to be rebuilt from")
+        # Imported here as the views use this module
+        from omero_metrics import views
+
+        rebuilt = views.rebuild_context(kwargs["request"], source)
+        if not isinstance(rebuilt, dict):
+            raise ValueError(f"Unexpected response {rebuilt}")
+    except Exception as e:
+        logger.error(f"Could not rebuild the context from {source}: {e}")
+        return {
+            "message": "This page has expired. Please reload it.",
+            "traceback": traceback.format_exc(),
+        }
+    session_state["context"] = store_context(rebuilt, source=source)
+    with contextlib.suppress(KeyError, AttributeError):
+        kwargs["request"].session.modified = True
+    return rebuilt
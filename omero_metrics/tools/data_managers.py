@@ -1,23 +1,40 @@
 import datetime
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from microscopemetrics_schema.datamodel import microscopemetrics_schema as mm_schema
 from omero.gateway import (
     BlitzGateway,
     DatasetWrapper,
+    FileAnnotationWrapper,
     ImageWrapper,
     ProjectWrapper,
 )
 
-from omero_metrics.tools import context_loaders, delete, dump, load, update
+from omero_metrics.tools import (
+    context_loaders,
+    delete,
+    dump,
+    load,
+    omero_tools,
+    update,
+)
+from omero_metrics.tools.cache import get_context_snapshots
 from omero_metrics.tools.data_type import (
     KKM_MAPPINGS,
     TEMPLATE_MAPPINGS_DATASET,
     TEMPLATE_MAPPINGS_IMAGE,
 )
+from omero_metrics.tools.serializers import has_blobs
 
 logger = logging.getLogger(__name__)
 
+# Number of threads loading the datasets of a project concurrently
+DATASET_LOAD_WORKERS = 4
+
+# Output fields of the datasets needed by the project dashboards
+PROJECT_OUTPUT_FIELDS = ["key_measurements"]
 
 DATASET_CONTEXT_LOADERS = {
     "FieldIlluminationDataset": context_loaders.FieldIlluminationDataset,
@@ -158,14 +175,32 @@ class DatasetManager:
         dump._remove_unsupported_types(self.mm_dataset.input_parameters)
         dump._remove_unsupported_types(self.mm_dataset.output)
 
-    def load_context(self):
-        self.load_data(load_images=False)
+    def load_context(self, use_snapshot: bool = True):
+        file_anns = load.load_file_annotations(
+            self._conn, "Dataset", [self.omero_dataset.getId()]
+        )[self.omero_dataset.getId()]
+        analysis_ann = load.get_analysis_file_annotation(
+            self.omero_dataset, file_anns
+        )
+        if use_snapshot and analysis_ann is not None:
+            # The context only depends on the analysis, so an unchanged analysis reuses it
+            snapshot = get_context_snapshots().get(analysis_ann)
+            if snapshot is not None and has_blobs(snapshot["context"]):
+                self.app_name = snapshot["app_name"]
+                self.context = snapshot["context"]
+                return
+        self.load_data(load_images=False, file_anns=file_anns)
         if self.is_processed():
             if self.mm_dataset.__class__.__name__ in TEMPLATE_MAPPINGS_DATASET:
                 self.app_name = TEMPLATE_MAPPINGS_DATASET.get(
                     self.mm_dataset.__class__.__name__
                 )
                 DATASET_CONTEXT_LOADERS[self.mm_dataset.__class__.__name__](self)
+                if analysis_ann is not None:
+                    get_context_snapshots().put(
+                        analysis_ann,
+                        {"app_name": self.app_name, "context": self.context},
+                    )
 
             else:
                 message = "Unknown analysis type. Unable to visualize"
@@ -195,9 +230,20 @@ class DatasetManager:
                 logger.warning(message)
                 self.context, self.app_name = warning_message(message)
 
-    def load_data(self, load_images: bool, force_reload: bool = False):
+    def load_data(
+        self,
+        load_images: bool,
+        force_reload: bool = False,
+        file_anns: list[FileAnnotationWrapper] = None,
+        output_fields: list[str] = None,
+    ):
         if force_reload or self.mm_dataset is None:
-            self.mm_dataset = load.load_dataset(self.omero_dataset, load_images)
+            self.mm_dataset = load.load_dataset(
+                self.omero_dataset,
+                load_images,
+                file_anns=file_anns,
+                output_fields=output_fields,
+            )
             self.kkm = KKM_MAPPINGS.get(self.mm_dataset.__class__.__name__)
         else:
             raise NotImplementedError(
@@ -308,25 +354,49 @@ class ProjectManager:
     to interact with OMERO and load and dump data.
     """
 
-    def __init__(self, conn: BlitzGateway, omero_project: ProjectWrapper):
+    def __init__(
+        self,
+        conn: BlitzGateway,
+        omero_project: ProjectWrapper,
+        max_workers: int = DATASET_LOAD_WORKERS,
+    ):
         self._conn = conn
         self.omero_project = omero_project
+        self.max_workers = max_workers
         self.mm_dataset_collection = None
         self.unprocessed_datasets = set()
         self.input_parameters = None
         self.sample = None
         self.thresholds = None
+        self.file_anns = None
+        self.output_fields = None
         self.app_name = None
         self.context = {}
 
-    def load_data(self, force_reload=False):
+    def load_data(self, force_reload=False, output_fields: list[str] = None):
+        """Loads the datasets of the project.
+        output_fields restricts the output fields loaded for every dataset.
+        """
         if self.mm_dataset_collection is not None and not force_reload:
-            return
+            if self.output_fields is None or (
+                output_fields is not None
+                and set(output_fields) <= set(self.output_fields)
+            ):
+                return
+        self.output_fields = output_fields
+        self.unprocessed_datasets = set()
         datasets_types = set()
         datasets = []
-        for dataset in self.omero_project.listChildren():
-            dm = DatasetManager(self._conn, dataset)
-            dm.load_data(load_images=False, force_reload=force_reload)
+        omero_datasets = sorted(
+            self.omero_project.listChildren(), key=lambda d: d.getId()
+        )
+        file_anns = load.load_file_annotations(
+            self._conn, "Dataset", [d.getId() for d in omero_datasets]
+        )
+        dataset_managers = self._load_dataset_managers(
+            omero_datasets, file_anns, force_reload, output_fields
+        )
+        for dataset, dm in zip(omero_datasets, dataset_managers):
             if dm.mm_dataset is not None:
                 datasets.append(dm.mm_dataset)
                 datasets_types.add(dm.mm_dataset.__class__.__name__)
@@ -350,13 +420,70 @@ class ProjectManager:
         else:
             self.mm_dataset_collection = None
 
+    def _load_dataset_managers(
+        self,
+        omero_datasets: list[DatasetWrapper],
+        file_anns: dict[int, list[FileAnnotationWrapper]],
+        force_reload: bool,
+        output_fields: list[str] = None,
+    ) -> list[DatasetManager]:
+        """Loads the datasets of the project concurrently on a bounded thread pool.
+        Every worker thread uses its own clone of the connection.
+        The managers are returned in the same order as omero_datasets.
+        """
+
+        def _load(conn, dataset, dataset_file_anns):
+            dm = DatasetManager(conn, dataset)
+            dm.load_data(
+                load_images=False,
+                force_reload=force_reload,
+                file_anns=dataset_file_anns,
+                output_fields=output_fields,
+            )
+            return dm
+
+        if self.max_workers <= 1 or len(omero_datasets) <= 1:
+            return [
+                _load(self._conn, dataset, file_anns[dataset.getId()])
+                for dataset in omero_datasets
+            ]
+
+        worker_conns = []
+        thread_data = threading.local()
+        lock = threading.Lock()
+
+        def _load_in_worker(dataset):
+            if not hasattr(thread_data, "conn"):
+                thread_data.conn = omero_tools.clone_connection(self._conn)
+                with lock:
+                    worker_conns.append(thread_data.conn)
+            conn = thread_data.conn
+            # Rebind the wrappers to the connection of the worker
+            return _load(
+                conn,
+                DatasetWrapper(conn, dataset._obj),
+                [
+                    FileAnnotationWrapper(conn, ann._obj)
+                    for ann in file_anns[dataset.getId()]
+                ],
+            )
+
+        try:
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(omero_datasets))
+            ) as executor:
+                return list(executor.map(_load_in_worker, omero_datasets))
+        finally:
+            for conn in worker_conns:
+                conn.close(hard=False)
+
     def is_harmonized(self):
         return isinstance(
             self.mm_dataset_collection, mm_schema.HarmonizedMetricsDatasetCollection
         )
 
     def load_context(self):
-        self.load_data()
+        self.load_data(output_fields=PROJECT_OUTPUT_FIELDS)
         if self.mm_dataset_collection is None:
             # Empty project or non-analyzed we cannot know if it is harmonized or not
             context_loaders.EmptyMetricsDatasetCollection(self)
@@ -377,6 +504,18 @@ class ProjectManager:
         pass
 
     def delete_processed_data(self):
+        if self.output_fields is not None:
+            # All the outputs are needed to find the objects to delete
+            self.load_data(force_reload=True)
+        file_anns = load.load_file_annotations(
+            self._conn,
+            "Dataset",
+            [
+                dataset.data_reference.omero_object_id
+                for dataset in self.mm_dataset_collection.dataset_collection
+                if dataset.processed
+            ],
+        )
         for dataset in self.mm_dataset_collection.dataset_collection:
             if dataset.processed:
                 logger.debug(f"Deleting processed data for dataset {dataset.name}")
@@ -387,6 +526,7 @@ class ProjectManager:
                         self._conn.getObject(
                             "Dataset", dataset.data_reference.omero_object_id
                         ),
+                        file_anns=file_anns[dataset.data_reference.omero_object_id],
                     )
                 except Exception as e:
                     logger.error(f"Error deleting processed data: {e}")
@@ -395,16 +535,27 @@ class ProjectManager:
                 else:
                     logger.info("Processed data deleted.")
 
+    def _load_file_annotations(self):
+        if self.file_anns is None:
+            self.file_anns = load.load_file_annotations(
+                self._conn, "Project", [self.omero_project.getId()]
+            )[self.omero_project.getId()]
+        return self.file_anns
+
     def load_input_config(self):
         if self.input_parameters is None:
-            config = load.load_input_config_file(self.omero_project)
+            config = load.load_input_config_file(
+                self.omero_project, file_anns=self._load_file_annotations()
+            )
             if config is not None:
                 self.input_parameters = config.get("input_parameters")
                 self.sample = config.get("sample")
 
     def load_thresholds(self):
         if self.thresholds is None:
-            self.thresholds = load.load_thresholds_file(self.omero_project)
+            self.thresholds = load.load_thresholds_file(
+                self.omero_project, file_anns=self._load_file_annotations()
+            )
 
 
 class MicroscopeManager:
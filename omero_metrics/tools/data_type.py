@@ -2,6 +2,11 @@ from microscopemetrics.analyses import field_illumination, psf_beads
 
 DATASET_TYPES = ["FieldIlluminationDataset", "PSFBeadsDataset"]
 
+# Suffix appended to the namespace of a dataset to tag its compact JSON sidecar
+SIDECAR_NS_SUFFIX = "/sidecar"
+# Format of the size of the block index at the start of the sidecar
+SIDECAR_HEADER_FORMAT = ">Q"
+
 INPUT_IMAGES_MAPPING = {
     "FieldIlluminationDataset": "field_illumination_images",
     "PSFBeadsDataset": "psf_beads_images",
@@ -4,8 +4,9 @@ import microscopemetrics_schema.datamodel as mm_schema
 import omero
 from omero.gateway import BlitzGateway, DatasetWrapper, FileAnnotationWrapper
 
-from omero_metrics.tools import omero_tools
-from omero_metrics.tools.data_type import DATASET_TYPES
+from omero_metrics.tools import load, omero_tools
+from omero_metrics.tools.cache import get_dataset_cache
+from omero_metrics.tools.data_type import DATASET_TYPES, SIDECAR_NS_SUFFIX
 
 logger = logging.getLogger(__name__)
 
@@ -59,22 +60,30 @@ def delete_mm_obj_omero_refs(conn: BlitzGateway, mm_obj: mm_schema.MetricsObject
         raise e
 
 
-def delete_dataset_file_ann(conn: BlitzGateway, dataset: DatasetWrapper):
+def delete_dataset_file_ann(
+    conn: BlitzGateway,
+    dataset: DatasetWrapper,
+    file_anns: list[FileAnnotationWrapper] = None,
+):
     logger.info(f"Deleting file annotations for dataset {dataset.getId()}")
-    for ann in dataset.listAnnotations():
-        if isinstance(ann, FileAnnotationWrapper):
-            ns = ann.getNs()
-            if ns.startswith("microscopemetrics_schema:analyses"):
-                ds_type = ns.split("/")[-1]
-                logger.info(f"Deleting {ds_type} file annotation {ann.getId()}")
-                if ds_type in DATASET_TYPES:
-                    omero_tools.del_object(
-                        conn=conn,
-                        object_ref=("Annotation", ann.getId()),
-                        delete_anns=True,
-                        delete_children=True,
-                        dry_run_first=True,
-                    )
+    get_dataset_cache().invalidate(dataset.getId())
+    if file_anns is None:
+        file_anns = load.load_file_annotations(conn, "Dataset", [dataset.getId()])[
+            dataset.getId()
+        ]
+    for ann in file_anns:
+        ns = ann.getNs()
+        if ns.startswith("microscopemetrics_schema:analyses"):
+            ds_type = ns.removesuffix(SIDECAR_NS_SUFFIX).split("/")[-1]
+            logger.info(f"Deleting {ds_type} file annotation {ann.getId()}")
+            if ds_type in DATASET_TYPES:
+                omero_tools.del_object(
+                    conn=conn,
+                    object_ref=("Annotation", ann.getId()),
+                    delete_anns=True,
+                    delete_children=True,
+                    dry_run_first=True,
+                )
 
 
 def delete_all_annotations(conn, group_id):
@@ -1,25 +1,43 @@
 import ast
 import contextlib
+import gzip
+import json
 import logging
+import struct
 import tempfile
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from dataclasses import fields
 from typing import Dict, List, Union
 
 import pandas as pd
-from linkml_runtime.dumpers import YAMLDumper
+from linkml_runtime.dumpers import JSONDumper, YAMLDumper
 from microscopemetrics_schema.datamodel import microscopemetrics_schema as mm_schema
 from omero.gateway import (
     BlitzGateway,
     DatasetWrapper,
     ExperimenterGroupWrapper,
+    FileAnnotationWrapper,
     ImageWrapper,
     ProjectWrapper,
 )
 
 from omero_metrics.tools import omero_tools
+from omero_metrics.tools.cache import get_dataset_cache
+from omero_metrics.tools.data_type import SIDECAR_HEADER_FORMAT, SIDECAR_NS_SUFFIX
 
 logger = logging.getLogger(__name__)
 
+# Number of threads writing the outputs of a dataset concurrently
+DUMP_WORKERS = 4
+
+# OMERO type of the object created by dumping an output element
+DUMPED_OBJECT_TYPES = {
+    mm_schema.Image: "Image",
+    mm_schema.Table: "FileAnnotation",
+    mm_schema.Comment: "Annotation",
+}
+
 SHAPE_TO_FUNCTION = {
     "Point": omero_tools.create_shape_point,
     "Line": omero_tools.create_shape_line,
@@ -163,6 +181,7 @@ def _dump_mm_dataset_as_file_annotation(
         DatasetWrapper,
         list[Union[ProjectWrapper, DatasetWrapper]],
     ],
+    dump_sidecar: bool = True,
 ):
     # We need to remove the data on the numpy and pandas data objects as they cannot be serialized by linkml
     _remove_unsupported_types(mm_dataset.input_data)
@@ -189,9 +208,91 @@ def _dump_mm_dataset_as_file_annotation(
             mimetype="application/yaml",
         )
 
+    if dump_sidecar:
+        _dump_mm_dataset_sidecar(
+            conn=conn,
+            mm_dataset=mm_dataset,
+            target_omero_obj=target_omero_obj,
+            yaml_file_ann=file_ann,
+        )
+
     return file_ann
 
 
+def _dump_mm_dataset_sidecar(
+    conn: BlitzGateway,
+    mm_dataset: mm_schema.MetricsDataset,
+    target_omero_obj: Union[
+        ProjectWrapper,
+        DatasetWrapper,
+        list[Union[ProjectWrapper, DatasetWrapper]],
+    ],
+    yaml_file_ann: FileAnnotationWrapper,
+):
+    """Dumps the dataset next to the YAML file in a compact format that can be read partially.
+    The file name is prefixed so that it is not mistaken for the YAML file.
+    The sidecar records the id and hash of the YAML file it was written for.
+    """
+    data = json.loads(JSONDumper().dumps(mm_dataset, inject_type=False))
+
+    with tempfile.NamedTemporaryFile(
+        prefix=f"sidecar_{mm_dataset.class_name}_",
+        suffix=".sidecar",
+        mode="wb",
+        delete=False,
+    ) as f:
+        f.write(
+            _encode_sidecar(data, omero_tools.get_file_fingerprint(yaml_file_ann))
+        )
+        f.close()
+        file_ann = omero_tools.create_file(
+            conn=conn,
+            file_path=f.name,
+            omero_object=target_omero_obj,
+            file_description=f"Compact copy of {mm_dataset.class_name} {mm_dataset.name}",
+            namespace=f"{mm_dataset.class_class_curie}{SIDECAR_NS_SUFFIX}",
+            mimetype="application/octet-stream",
+        )
+
+    return file_ann
+
+
+def _encode_sidecar(data: dict, source: dict = None) -> bytes:
+    """Encodes a dataset dictionary as a sequence of gzip compressed JSON blocks.
+    The non-scalar output fields get a block each so that readers may skip them.
+    The blocks are preceded by their index, with offsets relative to the first block,
+    and by the size of the index. The index holds the fingerprint of the source YAML file.
+    """
+    data = dict(data)
+    output = dict(data.get("output") or {})
+    output_blocks = {
+        name: output.pop(name)
+        for name in list(output)
+        if isinstance(output[name], (dict, list))
+    }
+    if "output" in data:
+        data["output"] = output
+
+    blocks = []
+    offset = 0
+
+    def _add_block(value) -> list[int]:
+        nonlocal offset
+        block = gzip.compress(json.dumps(value, separators=(",", ":")).encode())
+        blocks.append(block)
+        offset += len(block)
+        return [offset - len(block), len(block)]
+
+    index = {
+        "source": source,
+        "dataset": _add_block(data),
+        "output": {name: _add_block(value) for name, value in output_blocks.items()},
+    }
+    index = json.dumps(index, separators=(",", ":")).encode()
+
+    return b"".join([struct.pack(SIDECAR_HEADER_FORMAT, len(index)), index, *blocks])
+
+
 def dump_dataset(
     conn: BlitzGateway,
     dataset: mm_schema.MetricsDataset,
@@ -200,6 +301,7 @@ def dump_dataset(
     dump_analysis: bool = True,
     dump_as_project_file_annotation: bool = True,
     dump_as_dataset_file_annotation: bool = False,
+    dump_sidecar: bool = True,
 ) -> DatasetWrapper:
 
     if dataset.data_reference:
@@ -236,6 +338,8 @@ def dump_dataset(
         )
         dataset.data_reference = omero_tools.get_ref_from_object(omero_dataset)
 
+    get_dataset_cache().invalidate(omero_dataset.getId())
+
     try:
         if dump_input_images:
             for input_field in fields(dataset.input_data):
@@ -262,9 +366,17 @@ def dump_dataset(
             if dataset.processed:
                 if dataset.output is not None:
 
-                    _dump_analysis_metadata(dataset, omero_dataset)
+                    metadata_ann = _dump_analysis_metadata(dataset, omero_dataset)
 
-                    _dump_dataset_output(dataset.output, omero_dataset)
+                    _dump_dataset_output(
+                        dataset.output,
+                        omero_dataset,
+                        created_refs=(
+                            [("Annotation", metadata_ann.getId())]
+                            if metadata_ann is not None
+                            else []
+                        ),
+                    )
                 else:
                     logger.error(
                         f"Dataset {dataset.name} is processed but has no output. Skipping dump."
@@ -284,7 +396,10 @@ def dump_dataset(
 
         if target_objs:
             _dump_mm_dataset_as_file_annotation(
-                conn=conn, mm_dataset=dataset, target_omero_obj=target_objs
+                conn=conn,
+                mm_dataset=dataset,
+                target_omero_obj=target_objs,
+                dump_sidecar=dump_sidecar,
             )
     except Exception as e:
         logger.error(f"Dataset {dataset.name} could not be dumped to OMERO: {e}")
@@ -316,7 +431,7 @@ def _dump_analysis_metadata(
         **output_metadata,
     }
 
-    omero_tools.create_key_value(
+    return omero_tools.create_key_value(
         conn=target_dataset._conn,
         annotation=metadata,
         omero_object=target_dataset,
@@ -370,7 +485,19 @@ def _get_output_metadata(
 def _dump_dataset_output(
     dataset_output: mm_schema.MetricsOutput,
     target_dataset: DatasetWrapper,
+    max_workers: int = DUMP_WORKERS,
+    created_refs: list[tuple[str, int]] = None,
 ):
+    """Dump the output elements of a dataset, max_workers at a time.
+    Images, tables and comments are written concurrently. ROIs are written once
+    the images are, as they may be linked to them. If any element fails, the objects
+    already created, and those in created_refs, are deleted and the first error
+    is raised.
+    The rollback is best-effort: the objects of an element are recorded once the
+    element is written, and images, tables and ROIs delete their own objects if
+    they fail halfway. An annotation saved but failing to be linked is left behind,
+    as is anything a failing deletion could not remove.
+    """
     logger.info(f"Dumping {dataset_output.class_name} to OMERO")
     if not isinstance(target_dataset, DatasetWrapper):
         logger.error(
@@ -383,25 +510,107 @@ def _dump_dataset_output(
         )
         return None
     conn = target_dataset._conn
+    elements = []
+    rois = []
     for output_field in fields(dataset_output):
         output_element = getattr(dataset_output, output_field.name)
         if isinstance(output_element, mm_schema.MetricsObject):
-            _dump_output_element(
-                conn=conn,
-                output_element=output_element,
-                target_dataset=target_dataset,
-            )
-        elif isinstance(output_element, list) and all(
-            isinstance(i, mm_schema.MetricsObject) for i in output_element
+            output_element = [output_element]
+        elif not (
+            isinstance(output_element, list)
+            and all(isinstance(i, mm_schema.MetricsObject) for i in output_element)
         ):
-            for element in output_element:
-                _dump_output_element(
-                    conn=conn,
-                    output_element=element,
-                    target_dataset=target_dataset,
-                )
-        else:
             continue
+        for element in output_element:
+            if isinstance(element, mm_schema.Roi):
+                rois.append(element)
+            else:
+                elements.append(element)
+
+    # Appended by the workers, under lock, as soon as each element is written
+    created_refs = list(created_refs or [])
+    lock = threading.Lock()
+    worker_conns = []
+    thread_data = threading.local()
+
+    def _get_worker_conn():
+        if max_workers <= 1:
+            return conn
+        if not hasattr(thread_data, "conn"):
+            thread_data.conn = omero_tools.clone_connection(conn)
+            with lock:
+                worker_conns.append(thread_data.conn)
+        return thread_data.conn
+
+    def _dump(element):
+        worker_conn = _get_worker_conn()
+        if isinstance(element, list):
+            omero_rois = dump_rois(conn=worker_conn, rois=element)
+            refs = [("Roi", omero_roi.getId()) for omero_roi in omero_rois]
+        else:
+            omero_obj = _dump_output_element(
+                conn=worker_conn,
+                output_element=element,
+                # Rebind the wrapper to the connection of the worker
+                target_dataset=DatasetWrapper(worker_conn, target_dataset._obj),
+            )
+            refs = [
+                (object_type, omero_obj.getId())
+                for mm_type, object_type in DUMPED_OBJECT_TYPES.items()
+                if omero_obj is not None and isinstance(element, mm_type)
+            ]
+        with lock:
+            created_refs.extend(refs)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            futures = {executor.submit(_dump, e): e for e in elements}
+            image_futures = [
+                f for f, e in futures.items() if isinstance(e, mm_schema.Image)
+            ]
+            done, _ = wait(image_futures, return_when=FIRST_EXCEPTION)
+            if rois and not any(f.exception() for f in done):
+                futures[executor.submit(_dump, rois)] = rois
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            if any(f.exception() for f in done):
+                for f in not_done:
+                    f.cancel()
+    finally:
+        for worker_conn in worker_conns:
+            worker_conn.close(hard=False)
+
+    errors = [
+        (element, f.exception())
+        for f, element in futures.items()
+        if not f.cancelled() and f.exception() is not None
+    ]
+    if errors:
+        for element, e in errors:
+            name = "ROIs" if isinstance(element, list) else element.name
+            logger.error(f"Error dumping {name} to OMERO: {e}")
+        _rollback_dump(conn, created_refs, elements + rois)
+        raise errors[0][1]
+
+
+def _rollback_dump(
+    conn: BlitzGateway,
+    created_refs: list[tuple[str, int]],
+    elements: list[mm_schema.MetricsObject],
+):
+    logger.warning(f"Rolling back the dump of {len(created_refs)} objects")
+    try:
+        omero_tools.del_objects(
+            conn=conn,
+            object_refs=created_refs,
+            delete_anns=True,
+            delete_children=True,
+            dry_run_first=False,
+            wait=True,
+        )
+    except Exception as e:
+        logger.error(f"Error deleting the objects of a failed dump: {e}")
+    for element in elements:
+        element.data_reference = None
 
 
 def _dump_output_element(
@@ -499,6 +708,63 @@ def dump_roi(
         else:
             target_image = target_images[0]
 
+    omero_roi = omero_tools.create_roi(
+        conn=conn,
+        image=target_image,
+        shapes=_create_omero_shapes(roi),
+        name=roi.name,
+        description=roi.description,
+    )
+
+    roi.data_reference = omero_tools.get_ref_from_object(omero_roi)
+
+    return omero_roi
+
+
+def dump_rois(
+    conn: BlitzGateway,
+    rois: List[mm_schema.Roi],
+    batch_size: int = omero_tools.ROI_BATCH_SIZE,
+) -> list:
+    """Dump a list of ROIs to the images they are linked to.
+    The target images are fetched in a single query and the ROIs are saved
+    batch_size at a time.
+    """
+    image_ids = []
+    for roi in rois:
+        if not roi.linked_references:
+            raise TypeError(
+                f"ROI {roi.name} must be linked to an image. No image provided."
+            )
+        if len(roi.linked_references) != 1:
+            raise TypeError(f"ROI {roi.name} must be linked to a single image.")
+        image_ids.append(roi.linked_references[0].omero_object_id)
+
+    target_images = {
+        image.getId(): image
+        for image in conn.getObjects("Image", list(set(image_ids)))
+    }
+    missing_ids = set(image_ids) - set(target_images)
+    if missing_ids:
+        raise TypeError(
+            f"Images {sorted(missing_ids)} linked to the ROIs not found."
+        )
+
+    omero_rois = omero_tools.create_rois(
+        conn=conn,
+        images=[target_images[image_id] for image_id in image_ids],
+        shapes=[_create_omero_shapes(roi) for roi in rois],
+        names=[roi.name for roi in rois],
+        descriptions=[roi.description for roi in rois],
+        batch_size=batch_size,
+    )
+    for roi, omero_roi in zip(rois, omero_rois):
+        roi.data_reference = omero_tools.get_ref_from_object(omero_roi)
+
+    return omero_rois
+
+
+def _create_omero_shapes(roi: mm_schema.Roi) -> list:
     handler = {
         "points": lambda shape: omero_tools.create_shape_point(shape),
         "lines": lambda shape: omero_tools.create_shape_line(shape),
@@ -520,17 +786,7 @@ def dump_roi(
         )
         shapes += [shape_handler(shape) for shape in getattr(roi, shape_field.name)]
 
-    omero_roi = omero_tools.create_roi(
-        conn=conn,
-        image=target_image,
-        shapes=shapes,
-        name=roi.name,
-        description=roi.description,
-    )
-
-    roi.data_reference = omero_tools.get_ref_from_object(omero_roi)
-
-    return omero_roi
+    return shapes
 
 
 def dump_key_values(
@@ -570,6 +826,7 @@ def dump_table(
     conn: BlitzGateway,
     table: mm_schema.Table,
     target_object: Union[ImageWrapper, DatasetWrapper, ProjectWrapper] = None,
+    append_to_existing: bool = False,
 ):
     if not isinstance(table, mm_schema.Table):
         logger.error(f"Unsupported table type for {table.name}: {table.class_name}")
@@ -593,6 +850,7 @@ def dump_table(
         omero_object=target_object,
         table_description=table.description,
         namespace=table.class_class_curie,
+        append_to_existing=append_to_existing,
     )
     table.data_reference = omero_tools.get_ref_from_object(omero_table)
 
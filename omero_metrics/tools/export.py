@@ -0,0 +1,62 @@
+"""
+Export of microscope-metrics datasets for download.
+Exports are produced incrementally, one dataset at a time, so that they can be streamed.
+"""
+
+import zlib
+from typing import Iterable, Iterator
+
+from linkml_runtime.dumpers import JSONDumper, YAMLDumper
+from microscopemetrics_schema.datamodel import microscopemetrics_schema as mm_schema
+
+# Export format -> (content type, file extension)
+EXPORT_FORMATS = {
+    "yaml": ("application/yaml", "yaml"),
+    "json": ("application/json", "json"),
+    "text": ("text/plain", "txt"),
+}
+
+
+def iter_datasets_export(
+    mm_datasets: Iterable[mm_schema.MetricsDataset],
+    export_format: str,
+    as_list: bool = True,
+) -> Iterator[bytes]:
+    """Yields the export of the datasets one dataset at a time.
+    With as_list, the datasets are exported as a JSON array or as a multi-document YAML.
+    Otherwise, only the first dataset is exported as a single document.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Unknown export format {export_format}. Use one of {list(EXPORT_FORMATS)}"
+        )
+    if export_format == "json":
+        dumper = JSONDumper()
+        if as_list:
+            yield b"["
+        for i, mm_dataset in enumerate(mm_datasets):
+            if i > 0:
+                yield b","
+            yield dumper.dumps(mm_dataset).encode()
+            if not as_list:
+                return
+        if as_list:
+            yield b"]"
+    else:
+        dumper = YAMLDumper()
+        for mm_dataset in mm_datasets:
+            if as_list:
+                yield b"---\n"
+            yield dumper.dumps(mm_dataset).encode()
+            if not as_list:
+                return
+
+
+def iter_gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Compresses a stream of bytes chunk by chunk into the gzip format"""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
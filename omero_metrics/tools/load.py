@@ -1,5 +1,8 @@
+import gzip
+import json
 import logging
 import re
+import struct
 from dataclasses import asdict
 from datetime import datetime
 
@@ -19,14 +22,20 @@ from omero.gateway import (
 )
 
 from omero_metrics.tools import omero_tools
+from omero_metrics.tools.cache import get_dataset_cache, get_pixel_cache
 from omero_metrics.tools.data_type import (
     DATASET_IMAGES,
     DATASET_TYPES,
     INPUT_IMAGES_MAPPING,
+    SIDECAR_HEADER_FORMAT,
+    SIDECAR_NS_SUFFIX,
 )
 
 logger = logging.getLogger(__name__)
 
+# HQL patterns matching the namespaces of the file annotations written by omero-metrics
+FILE_ANNOTATION_NAMESPACES = ["microscopemetrics%", "threshold"]
+
 
 def get_annotations_tables(conn, group_id):
     all_annotations = conn.getObjects("Annotation", opts={"group": group_id})
@@ -126,30 +135,52 @@ def image_exist(image_id, mm_dataset):
     return image_found, image_location, index
 
 
-def load_input_config_file(project):
-    for ann in project.listAnnotations():
-        if isinstance(ann, FileAnnotationWrapper):
-            ns = ann.getNs()
-            if ns in [
-                cls.class_class_curie
-                for cls in mm_schema.MetricsInputParameters.__subclasses__()
-            ]:
-                return yaml.load(
-                    ann.getFileInChunks().__next__().decode(),
-                    Loader=yaml.SafeLoader,
-                )
+def load_file_annotations(
+    conn: BlitzGateway, object_type: str, object_ids: list[int]
+) -> dict[int, list[FileAnnotationWrapper]]:
+    """Load in a single query all the omero-metrics file annotations
+    linked to a set of projects or datasets, indexed by the parent id"""
+    return omero_tools.get_file_annotations(
+        conn,
+        object_type=object_type,
+        object_ids=object_ids,
+        namespaces=FILE_ANNOTATION_NAMESPACES,
+    )
+
+
+def _get_file_annotations(
+    obj: ProjectWrapper | DatasetWrapper,
+    file_anns: list[FileAnnotationWrapper] = None,
+) -> list[FileAnnotationWrapper]:
+    if file_anns is not None:
+        return file_anns
+    return load_file_annotations(obj._conn, obj.OMERO_CLASS, [obj.getId()])[
+        obj.getId()
+    ]
+
+
+def load_input_config_file(
+    project: ProjectWrapper, file_anns: list[FileAnnotationWrapper] = None
+):
+    input_parameters_ns = [
+        cls.class_class_curie
+        for cls in mm_schema.MetricsInputParameters.__subclasses__()
+    ]
+    for ann in _get_file_annotations(project, file_anns):
+        if ann.getNs() in input_parameters_ns:
+            with omero_tools.open_file_annotation(ann) as f:
+                return yaml.load(f, Loader=yaml.SafeLoader)
     return None
 
 
-def load_thresholds_file(project):
-    for ann in project.listAnnotations():
-        if isinstance(ann, FileAnnotationWrapper):
-            name = ann.getFile().getName()
-            if name.startswith("threshold"):
-                return yaml.load(
-                    ann.getFileInChunks().__next__().decode(),
-                    Loader=yaml.SafeLoader,
-                )
+def load_thresholds_file(
+    project: ProjectWrapper, file_anns: list[FileAnnotationWrapper] = None
+):
+    for ann in _get_file_annotations(project, file_anns):
+        name = ann.getFile().getName()
+        if name.startswith("threshold"):
+            with omero_tools.open_file_annotation(ann) as f:
+                return yaml.load(f, Loader=yaml.SafeLoader)
     return None
 
 
@@ -159,44 +190,165 @@ def load_project(
     collection = mm_schema.MetricsDatasetCollection()
     file_anns = []
     dataset_types = []
-    project = conn.getObject("Project", project_id)
     try:
-        for file_ann in project.listAnnotations():
-            if isinstance(file_ann, FileAnnotationWrapper):
-                ds_type = file_ann.getFileName().split("_")[0]
-                if ds_type in DATASET_TYPES:
-                    file_anns.append(file_ann)
-                    dataset_types.append(ds_type)
+        for file_ann in load_file_annotations(conn, "Project", [project_id])[
+            project_id
+        ]:
+            ds_type = file_ann.getFileName().split("_")[0]
+            if ds_type in DATASET_TYPES:
+                file_anns.append(file_ann)
+                dataset_types.append(ds_type)
 
         for file_ann, ds_type in zip(file_anns, dataset_types):
-            collection.dataset_collection.append(
-                yaml_loader.loads(
-                    file_ann.getFileInChunks().__next__().decode(),
-                    target_class=getattr(mm_schema, ds_type),
+            with omero_tools.open_file_annotation(file_ann) as f:
+                collection.dataset_collection.append(
+                    yaml_loader.load(f, target_class=getattr(mm_schema, ds_type))
                 )
-            )
         return collection
     except Exception as e:
         logger.error(f"Error loading project {project_id}: {e}")
         return collection
 
 
+def _read_sidecar_index(read) -> tuple[dict, int]:
+    """Reads the block index of a sidecar file.
+    Returns the index and the offset of the first block.
+    """
+    header_size = struct.calcsize(SIDECAR_HEADER_FORMAT)
+    (index_size,) = struct.unpack(SIDECAR_HEADER_FORMAT, read(0, header_size))
+    index = json.loads(bytes(read(header_size, index_size)))
+    return index, header_size + index_size
+
+
+def _read_sidecar(read, output_fields: list[str] = None) -> dict:
+    """Decodes a dataset dictionary from a sidecar file.
+    read(offset, length) returns a byte range of the file. Only the output fields
+    in output_fields are read, or all of them if output_fields is None.
+    """
+    index, blocks_start = _read_sidecar_index(read)
+
+    def _read_block(offset: int, length: int):
+        return json.loads(gzip.decompress(read(blocks_start + offset, length)))
+
+    data = _read_block(*index["dataset"])
+    for name, (offset, length) in index["output"].items():
+        if output_fields is None or name in output_fields:
+            data["output"][name] = _read_block(offset, length)
+    return data
+
+
+def _load_mm_dataset_sidecar(
+    file_ann: FileAnnotationWrapper,
+    yaml_ann: FileAnnotationWrapper,
+    ds_type: str,
+    output_fields: list[str] = None,
+) -> mm_schema.MetricsDataset | None:
+    """Load a dataset from a sidecar written next to the YAML file of yaml_ann.
+    If output_fields is provided, only those output fields are read from OMERO.
+    Returns None if the sidecar was not written for that same YAML file or cannot be
+    read so that the caller may fall back to the YAML.
+    """
+    source = omero_tools.get_file_fingerprint(yaml_ann)
+    try:
+        with omero_tools.open_raw_file_store(file_ann) as store:
+            index, _ = _read_sidecar_index(store.read)
+            if index.get("source") != source:
+                # Left over from a previous analysis or the YAML was rewritten
+                logger.debug(
+                    f"Sidecar {file_ann.getId()} is not a copy of {yaml_ann.getId()}"
+                )
+                return None
+            if output_fields is not None:
+                data = _read_sidecar(store.read, output_fields)
+                try:
+                    return getattr(mm_schema, ds_type)(**data)
+                except ValueError as e:
+                    # The schema may require some of the fields that were skipped
+                    logger.debug(f"Partial load of {ds_type} not possible: {e}")
+        content = memoryview(omero_tools.read_file_annotation(file_ann))
+        data = _read_sidecar(
+            lambda offset, length: content[offset : offset + length]
+        )
+        return getattr(mm_schema, ds_type)(**data)
+    except Exception as e:
+        logger.warning(
+            f"Could not load sidecar file annotation {file_ann.getId()}: {e}"
+        )
+        return None
+
+
+def _get_dataset_file_annotations(
+    dataset: DatasetWrapper, file_anns: list[FileAnnotationWrapper] = None
+) -> tuple[
+    list[tuple[str, FileAnnotationWrapper]], dict[str, list[FileAnnotationWrapper]]
+]:
+    """Get the analysis file annotations of a dataset.
+    Returns the (dataset type, YAML file annotation) pairs and the sidecars by dataset
+    type, latest first
+    """
+    yaml_anns = []
+    sidecar_anns = {}
+    for ann in _get_file_annotations(dataset, file_anns):
+        ns = ann.getNs()
+        if ns.startswith("microscopemetrics_schema:analyses"):
+            if ns.endswith(SIDECAR_NS_SUFFIX):
+                ds_type = ns[: -len(SIDECAR_NS_SUFFIX)].split("/")[-1]
+                sidecar_anns.setdefault(ds_type, []).append(ann)
+                continue
+            ds_type = ns.split("/")[-1]
+            if ds_type in DATASET_TYPES:
+                yaml_anns.append((ds_type, ann))
+    for anns in sidecar_anns.values():
+        anns.sort(key=lambda ann: ann.getId(), reverse=True)
+    return yaml_anns, sidecar_anns
+
+
+def get_analysis_file_annotation(
+    dataset: DatasetWrapper, file_anns: list[FileAnnotationWrapper] = None
+) -> FileAnnotationWrapper | None:
+    """Get the file annotation holding the analysis loaded by load_dataset, if any"""
+    yaml_anns, _ = _get_dataset_file_annotations(dataset, file_anns)
+    return yaml_anns[0][1] if yaml_anns else None
+
+
 def load_dataset(
-    dataset: DatasetWrapper, load_images: bool
+    dataset: DatasetWrapper,
+    load_images: bool,
+    file_anns: list[FileAnnotationWrapper] = None,
+    use_cache: bool = True,
+    output_fields: list[str] = None,
 ) -> mm_schema.MetricsDataset | None:
+    """Load the microscope-metrics dataset stored on an OMERO dataset.
+    file_anns may be provided from a previous bulk load_file_annotations call.
+    Parsed datasets are kept in the dataset cache unless use_cache is False.
+    output_fields restricts the output fields that are loaded, e.g. ["key_measurements"].
+    Scalar output fields are always loaded. Datasets without a sidecar are loaded in full.
+    """
+    yaml_anns, sidecar_anns = _get_dataset_file_annotations(dataset, file_anns)
+
     mm_datasets = []
-    for ann in dataset.listAnnotations():
-        if isinstance(ann, FileAnnotationWrapper):
-            ns = ann.getNs()
-            if ns.startswith("microscopemetrics_schema:analyses"):
-                ds_type = ns.split("/")[-1]
-                if ds_type in DATASET_TYPES:
-                    mm_datasets.append(
-                        yaml_loader.loads(
-                            ann.getFileInChunks().__next__().decode(),
-                            target_class=getattr(mm_schema, ds_type),
-                        )
+    for ds_type, ann in yaml_anns:
+        mm_dataset = get_dataset_cache().get(ann) if use_cache else None
+        if mm_dataset is None:
+            # The YAML file remains the reference. The sidecar is only a faster copy
+            partial = False
+            for sidecar_ann in sidecar_anns.get(ds_type, []):
+                mm_dataset = _load_mm_dataset_sidecar(
+                    sidecar_ann, ann, ds_type, output_fields
+                )
+                if mm_dataset is not None:
+                    partial = output_fields is not None
+                    break
+            if mm_dataset is None:
+                with omero_tools.open_file_annotation(ann) as f:
+                    mm_dataset = yaml_loader.load(
+                        f, target_class=getattr(mm_schema, ds_type)
                     )
+                partial = False
+            # Partially loaded datasets must not be served to other callers
+            if use_cache and not partial:
+                get_dataset_cache().put(ann, dataset.getId(), mm_dataset)
+        mm_datasets.append(mm_dataset)
     if len(mm_datasets) == 1:
         mm_dataset = mm_datasets[0]
     elif len(mm_datasets) > 1:
@@ -256,8 +408,16 @@ def load_analysis_config(project_wrapper=ProjectWrapper):
     return configs[-1].getId(), dict(configs[-1].getValue())
 
 
-def load_image(image: ImageWrapper, load_array: bool = True) -> mm_schema.Image:
-    """Load an image from OMERO and return it as a schema Image"""
+def load_image(
+    image: ImageWrapper,
+    load_array: bool = True,
+    use_cache: bool = True,
+    lazy: bool = False,
+) -> mm_schema.Image:
+    """Load an image from OMERO and return it as a schema Image.
+    If use_cache is True, the intensities are read from the local pixel cache when available
+    If lazy is True, array_data is a LazyImageArray fetching only the sliced planes from OMERO
+    """
     time_series = None
     channel_series = mm_schema.ChannelSeries(
         channels=[
@@ -272,7 +432,12 @@ def load_image(image: ImageWrapper, load_array: bool = True) -> mm_schema.Image:
         ]
     )
     source_images = []
-    array_data = _load_image_intensities(image) if load_array else None
+    if not load_array:
+        array_data = None
+    elif lazy:
+        array_data = LazyImageArray(image, use_cache=use_cache)
+    else:
+        array_data = _load_image_intensities(image, use_cache=use_cache)
     return mm_schema.Image(
         name=image.getName(),
         description=image.getDescription(),
@@ -293,8 +458,142 @@ def load_image(image: ImageWrapper, load_array: bool = True) -> mm_schema.Image:
     )
 
 
-def _load_image_intensities(image: ImageWrapper) -> np.ndarray:
-    return omero_tools.get_image_intensities(image).transpose((2, 0, 3, 4, 1))
+class LazyImageArray:
+    """A read-only proxy to the intensities of an OMERO image in the
+    microscope-metrics order TZYXC.
+    Numpy-style slicing is translated into a getPlanes/getTiles request for the
+    planes and region that are sliced, so only those are fetched from OMERO.
+    Converting the proxy into an array loads the whole image.
+    """
+
+    def __init__(self, image: ImageWrapper, use_cache: bool = True):
+        self.image = image
+        self.use_cache = use_cache
+        self.shape = (
+            image.getSizeT(),
+            image.getSizeZ(),
+            image.getSizeY(),
+            image.getSizeX(),
+            image.getSizeC(),
+        )
+        self.dtype = np.dtype(
+            omero_tools.DTYPES_OMERO_TO_NP[
+                image.getPrimaryPixels().getPixelsType().getValue()
+            ]
+        )
+        self._array = None
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __repr__(self) -> str:
+        return f"LazyImageArray(image={self.image.getId()}, shape={self.shape}, dtype={self.dtype})"
+
+    def __array__(self, dtype=None, copy=None):
+        if self._array is None:
+            self._array = _load_image_intensities(
+                self.image, use_cache=self.use_cache
+            )
+        return self._array if dtype is None else self._array.astype(dtype)
+
+    def _expand_key(self, key) -> tuple:
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = next(i for i, k in enumerate(key) if k is Ellipsis)
+            key = (
+                key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1 :]
+            )
+        if len(key) > self.ndim:
+            raise IndexError(
+                f"too many indices for array: array is {self.ndim}-dimensional, but {len(key)} were indexed"
+            )
+        return key + (slice(None),) * (self.ndim - len(key))
+
+    def __getitem__(self, key):
+        if self._array is not None:
+            return self._array[key]
+        key = self._expand_key(key)
+        if not all(isinstance(k, (int, np.integer, slice)) for k in key):
+            # Fancy indexing is resolved on the whole array
+            return np.asarray(self)[key]
+
+        request_ranges = {}
+        local_key = []
+        for axis, k, size in zip("tzyxc", key, self.shape):
+            if isinstance(k, slice):
+                r = range(*k.indices(size))
+                if len(r) == 0:
+                    return np.asarray(self)[key]
+                ascending = r if r.step > 0 else r[::-1]
+                if axis in "yx":
+                    # Tiles are contiguous regions so the step is applied locally
+                    request_ranges[axis] = range(ascending.start, ascending[-1] + 1)
+                    local_key.append(slice(None, None, r.step))
+                else:
+                    request_ranges[axis] = ascending
+                    local_key.append(slice(None, None, 1 if r.step > 0 else -1))
+            else:
+                if not -size <= k < size:
+                    raise IndexError(
+                        f"index {k} is out of bounds for axis {'tzyxc'.index(axis)} with size {size}"
+                    )
+                k = int(k) % size
+                request_ranges[axis] = range(k, k + 1)
+                local_key.append(0)
+
+        whole_planes = (
+            len(request_ranges["y"]) == self.shape[2]
+            and len(request_ranges["x"]) == self.shape[3]
+        )
+        intensities = omero_tools.get_image_intensities(
+            self.image,
+            z_range=request_ranges["z"],
+            c_range=request_ranges["c"],
+            t_range=request_ranges["t"],
+            y_range=None if whole_planes else request_ranges["y"],
+            x_range=None if whole_planes else request_ranges["x"],
+        )
+        # OMERO order zctyx -> microscope-metrics order TZYXC
+        return intensities.transpose((2, 0, 3, 4, 1))[tuple(local_key)]
+
+
+def _load_image_intensities(
+    image: ImageWrapper, use_cache: bool = True
+) -> np.ndarray:
+    """Load the intensities of an image in the microscope-metrics order TZYXC.
+    Planes are streamed from OMERO straight into the output array."""
+    if use_cache:
+        array_data = get_pixel_cache().get(image)
+        if array_data is not None:
+            return array_data
+
+    pixels = image.getPrimaryPixels()
+    array_data = np.empty(
+        shape=(
+            image.getSizeT(),
+            image.getSizeZ(),
+            image.getSizeY(),
+            image.getSizeX(),
+            image.getSizeC(),
+        ),
+        dtype=omero_tools.DTYPES_OMERO_TO_NP[pixels.getPixelsType().getValue()],
+    )
+    for z, c, t, plane in omero_tools.iter_image_intensities(image):
+        array_data[t, z, :, :, c] = plane
+
+    if use_cache:
+        array_data = get_pixel_cache().put(image, array_data)
+
+    return array_data
 
 
 def roi_finder(roi: mm_schema.Roi):
@@ -1,19 +1,25 @@
+import contextlib
 import datetime
+import io
 import json
 import logging
 import mimetypes
+from collections import deque
+from collections.abc import Iterator
 from dataclasses import fields, is_dataclass
 from itertools import product
 from random import choice
 from string import ascii_letters
 from typing import Union
 
+import Ice
 import numpy as np
 import pandas as pd
 from jsonasobj2._jsonobj import JsonObj
 from microscopemetrics_schema.datamodel import microscopemetrics_schema as mm_schema
 from omero import grid
 from omero.constants import metadata
+from omero.constants.projection import ProjectionType
 from omero.gateway import (
     BlitzGateway,
     BlitzObjectWrapper,
@@ -33,6 +39,7 @@ from omero.model import (
     DatasetI,
     DatasetImageLinkI,
     EllipseI,
+    FileAnnotationI,
     ImageI,
     LengthI,
     LineI,
@@ -47,6 +54,7 @@ from omero.model import (
     enums,
 )
 from omero.rtypes import rdouble, rint, rstring, rtime
+from omero.sys import ParametersI
 from pandas import DataFrame
 
 logger = logging.getLogger(__name__)
@@ -76,6 +84,23 @@ DTYPES_OMERO_TO_NP = {
     enums.PixelsTypedouble: "double",
 }
 
+# Size of the chunks used to read files from OMERO
+FILE_CHUNK_SIZE = 2621440
+# Number of ROIs persisted per server call by create_rois
+ROI_BATCH_SIZE = 500
+# Number of rows sent per server call by create_table and the attempts per call
+TABLE_ROW_BATCH_SIZE = 10000
+TABLE_WRITE_ATTEMPTS = 3
+# Transient errors on which a call is retried: connections lost, refused or timed out
+TABLE_WRITE_RETRY_ERRORS = (Ice.TimeoutException, Ice.SocketException)
+# Number of setTile calls in flight when uploading tiled images
+TILE_UPLOAD_WINDOW = 4
+
+PROJECTION_TYPES = {
+    "max": ProjectionType.MAXIMUMINTENSITY,
+    "mean": ProjectionType.MEANINTENSITY,
+    "sum": ProjectionType.SUMINTENSITY,
+}
 
 COLUMN_TYPES = {
     "string": grid.StringColumn,
@@ -94,6 +119,17 @@ COLUMN_TYPES = {
     "file": grid.FileColumn,
 }
 
+# Integer columns holding the ids of OMERO objects, by lower case column name
+ID_COLUMN_NAMES = {
+    **dict.fromkeys(["imageid", "image id", "image_id"], "image"),
+    **dict.fromkeys(["datasetid", "dataset id", "dataset_id"], "dataset"),
+    **dict.fromkeys(["plateid", "plate id", "plate_id"], "plate"),
+    **dict.fromkeys(["wellid", "well id", "well_id"], "well"),
+    **dict.fromkeys(["roiid", "roi id", "roi_id"], "roi"),
+    **dict.fromkeys(["mask", "maskid", "mask id", "mask_id"], "mask"),
+    **dict.fromkeys(["fileid", "file id", "file_id"], "file"),
+}
+
 
 def can_write(conn: BlitzGateway, obj: BlitzObjectWrapper) -> None:
     """
@@ -116,6 +152,18 @@ def can_write(conn: BlitzGateway, obj: BlitzObjectWrapper) -> None:
         return False
 
 
+def clone_connection(conn: BlitzGateway) -> BlitzGateway:
+    """Creates a new connection joined to the session of conn.
+    BlitzGateway connections should not be shared between threads, so every worker
+    thread uses its own clone. Close it with close(hard=False) to keep the session alive.
+    """
+    clone = BlitzGateway(client_obj=conn.c.createClient(secure=True))
+    group_id = conn.SERVICE_OPTS.getOmeroGroup()
+    if group_id is not None:
+        clone.SERVICE_OPTS.setOmeroGroup(group_id)
+    return clone
+
+
 def get_object_ids_from_url(url: str) -> list[tuple[str, int]]:
     """Get the ID from an OMERO URL. For example:
     https://omero.server.fr/webclient/?show=image-12345 or
@@ -285,25 +333,15 @@ def _get_pixel_size_units(image: ImageWrapper):
     )
 
 
-def get_image_intensities(
-    image: ImageWrapper,
+def _get_intensity_ranges(
+    image_shape: tuple,
     z_range: Union[int, tuple, range] = None,
     c_range: Union[int, tuple, range] = None,
     t_range: Union[int, tuple, range] = None,
     y_range: Union[int, tuple, range] = None,
     x_range: Union[int, tuple, range] = None,
-):
-    """Returns a numpy array containing the intensity values of the image
-    Returns an array with dimensions arranged as zctyx
-    """
-    image_shape = _get_image_shape(image)
-
-    # Decide if we are going to call getPlanes or getTiles
-    if not x_range and not y_range:
-        whole_planes = True
-    else:
-        whole_planes = False
-
+) -> list[range]:
+    """Normalizes the zctyx ranges requested on an image into a list of ranges"""
     ranges = [z_range, c_range, t_range, y_range, x_range]
     for dim, r in enumerate(ranges):
         if r is None:
@@ -327,26 +365,35 @@ def get_image_intensities(
         if not 1 <= ranges[dim].stop <= image_shape[dim]:
             raise IndexError("Specified range is outside of the image dimensions")
 
-    output_shape = (
-        len(ranges[0]),
-        len(ranges[1]),
-        len(ranges[2]),
-        len(ranges[3]),
-        len(ranges[4]),
-    )
-    nr_planes = output_shape[0] * output_shape[1] * output_shape[2]
-    zct_list = list(product(ranges[0], ranges[1], ranges[2]))
+    return ranges
 
-    pixels = image.getPrimaryPixels()
-    data_type = DTYPES_OMERO_TO_NP[pixels.getPixelsType().getValue()]
 
-    # intensities = np.zeros(output_shape, dtype=data_type)
+def iter_image_intensities(
+    image: ImageWrapper,
+    z_range: Union[int, tuple, range] = None,
+    c_range: Union[int, tuple, range] = None,
+    t_range: Union[int, tuple, range] = None,
+    y_range: Union[int, tuple, range] = None,
+    x_range: Union[int, tuple, range] = None,
+):
+    """Yields the intensity values of the image one plane (or tile) at a time.
+    Every item is a tuple (z, c, t, plane) where z, c and t are the indexes in the
+    original image and plane is a yx numpy array.
+    Only one plane is held in memory at any time.
+    """
+    image_shape = _get_image_shape(image)
+
+    # Decide if we are going to call getPlanes or getTiles
+    whole_planes = not x_range and not y_range
 
-    intensities = np.zeros(
-        shape=(nr_planes, output_shape[3], output_shape[4]), dtype=data_type
+    ranges = _get_intensity_ranges(
+        image_shape, z_range, c_range, t_range, y_range, x_range
     )
+    zct_list = list(product(ranges[0], ranges[1], ranges[2]))
+
+    pixels = image.getPrimaryPixels()
     if whole_planes:
-        np.stack(list(pixels.getPlanes(zctList=zct_list)), out=intensities)
+        planes = pixels.getPlanes(zctList=zct_list)
     else:
         # Tile is formatted (X, Y, Width, Heigth)
         tile_region = (
@@ -356,13 +403,269 @@ def get_image_intensities(
             len(ranges[3]),
         )
         zct_tile_list = [(z, c, t, tile_region) for z, c, t in zct_list]
-        np.stack(list(pixels.getTiles(zctTileList=zct_tile_list)), out=intensities)
+        planes = pixels.getTiles(zctTileList=zct_tile_list)
+
+    for (z, c, t), plane in zip(zct_list, planes):
+        yield z, c, t, plane
+
+
+def get_image_intensities(
+    image: ImageWrapper,
+    z_range: Union[int, tuple, range] = None,
+    c_range: Union[int, tuple, range] = None,
+    t_range: Union[int, tuple, range] = None,
+    y_range: Union[int, tuple, range] = None,
+    x_range: Union[int, tuple, range] = None,
+    out: np.ndarray = None,
+    memmap_path: str = None,
+):
+    """Returns a numpy array containing the intensity values of the image
+    Returns an array with dimensions arranged as zctyx
+    Planes are written into the output array as they are received from the server,
+    so the whole stack is only held once in memory.
+    :param out: A preallocated zctyx array to write the intensities into
+    :param memmap_path: If provided, the output array is a numpy memory-mapped .npy file at this path
+    """
+    image_shape = _get_image_shape(image)
+    ranges = _get_intensity_ranges(
+        image_shape, z_range, c_range, t_range, y_range, x_range
+    )
+    output_shape = tuple(len(r) for r in ranges)
+
+    pixels = image.getPrimaryPixels()
+    data_type = DTYPES_OMERO_TO_NP[pixels.getPixelsType().getValue()]
+
+    if out is not None:
+        if out.shape != output_shape:
+            raise ValueError(
+                f"Output array shape {out.shape} does not match the requested shape {output_shape}"
+            )
+        intensities = out
+    elif memmap_path is not None:
+        intensities = np.lib.format.open_memmap(
+            memmap_path, mode="w+", dtype=data_type, shape=output_shape
+        )
+    else:
+        intensities = np.empty(shape=output_shape, dtype=data_type)
+
+    for z, c, t, plane in iter_image_intensities(
+        image, ranges[0], ranges[1], ranges[2], y_range, x_range
+    ):
+        zi, ci, ti = ranges[0].index(z), ranges[1].index(c), ranges[2].index(t)
+        intensities[zi, ci, ti] = plane
+
+    return intensities
+
+
+def _project_plane(plane: np.ndarray, projection: str, axis: int) -> np.ndarray:
+    if projection == "max":
+        return plane.max(axis=axis, keepdims=True)
+    elif projection == "sum":
+        return plane.sum(axis=axis, keepdims=True, dtype="float64")
+    else:
+        return plane.mean(axis=axis, keepdims=True, dtype="float64")
+
+
+def get_image_projections(
+    image: ImageWrapper,
+    projection: str = "max",
+    axes: tuple = ("z",),
+    z_range: Union[int, tuple, range] = None,
+    c_range: Union[int, tuple, range] = None,
+    t_range: Union[int, tuple, range] = None,
+) -> dict[str, np.ndarray]:
+    """Returns a dictionary with the projections of the image along the requested axes
+    Planes are streamed from OMERO and folded into running accumulators, so only one
+    plane is held in memory on top of the projections.
+    Every projection is arranged as zctyx with the projected axis of size 1
+    :param projection: The projection method. One of "max", "mean" or "sum"
+    :param axes: The axes to project along. Any of "z", "y" and "x"
+    """
+    if projection not in PROJECTION_TYPES:
+        raise ValueError(
+            f"Projection {projection} is not supported. Use one of {list(PROJECTION_TYPES)}"
+        )
+    if not set(axes) <= {"z", "y", "x"}:
+        raise ValueError(f"Projection axes {axes} must be any of 'z', 'y' and 'x'")
+
+    image_shape = _get_image_shape(image)
+    ranges = _get_intensity_ranges(image_shape, z_range, c_range, t_range)
+    pixels = image.getPrimaryPixels()
+    data_type = DTYPES_OMERO_TO_NP[pixels.getPixelsType().getValue()]
+    acc_type = data_type if projection == "max" else "float64"
+
+    output_shapes = {
+        "z": (1, len(ranges[1]), len(ranges[2]), len(ranges[3]), len(ranges[4])),
+        "y": (len(ranges[0]), len(ranges[1]), len(ranges[2]), 1, len(ranges[4])),
+        "x": (len(ranges[0]), len(ranges[1]), len(ranges[2]), len(ranges[3]), 1),
+    }
+    projections = {a: np.zeros(output_shapes[a], dtype=acc_type) for a in axes}
+
+    seen_ct = set()
+    for z, c, t, plane in iter_image_intensities(
+        image, ranges[0], ranges[1], ranges[2]
+    ):
+        zi, ci, ti = ranges[0].index(z), ranges[1].index(c), ranges[2].index(t)
+        if "z" in projections:
+            if (ci, ti) not in seen_ct:
+                projections["z"][0, ci, ti] = plane
+                seen_ct.add((ci, ti))
+            elif projection == "max":
+                np.maximum(
+                    projections["z"][0, ci, ti],
+                    plane,
+                    out=projections["z"][0, ci, ti],
+                )
+            else:
+                projections["z"][0, ci, ti] += plane
+        if "y" in projections:
+            projections["y"][zi, ci, ti] = _project_plane(plane, projection, axis=0)
+        if "x" in projections:
+            projections["x"][zi, ci, ti] = _project_plane(plane, projection, axis=1)
+
+    if "z" in projections and projection == "mean":
+        projections["z"] /= len(ranges[0])
+
+    return projections
+
+
+def _get_server_projection(
+    image: ImageWrapper,
+    projection: str,
+    ranges: list[range],
+) -> np.ndarray:
+    """Projects the image along z on the OMERO server using the projection service"""
+    conn = image._conn
+    pixels = image.getPrimaryPixels()
+    if projection == "max":
+        pixels_type = pixels.getPixelsType()._obj
+        data_type = DTYPES_OMERO_TO_NP[pixels.getPixelsType().getValue()]
+    else:
+        # Mean and sum are computed as double to avoid clipping
+        pixels_type = conn.getQueryService().findByQuery(
+            "from PixelsType as p where p.value='double'", None
+        )
+        data_type = "float64"
+    projection_service = conn.getProjectionService()
 
-    intensities = np.reshape(intensities, newshape=output_shape)
+    output_shape = (
+        1,
+        len(ranges[1]),
+        len(ranges[2]),
+        len(ranges[3]),
+        len(ranges[4]),
+    )
+    intensities = np.empty(output_shape, dtype=data_type)
+    for (ci, c), (ti, t) in product(enumerate(ranges[1]), enumerate(ranges[2])):
+        plane = projection_service.projectStack(
+            pixels.getId(),
+            pixels_type,
+            PROJECTION_TYPES[projection],
+            t,
+            c,
+            ranges[0].step,
+            ranges[0].start,
+            ranges[0][-1],
+            conn.SERVICE_OPTS,
+        )
+        # OMERO sends the pixels big-endian
+        intensities[0, ci, ti] = np.frombuffer(
+            plane, dtype=np.dtype(data_type).newbyteorder(">")
+        ).reshape(output_shape[3:])
 
     return intensities
 
 
+def get_image_projection(
+    image: ImageWrapper,
+    projection: str = "max",
+    axis: str = "z",
+    z_range: Union[int, tuple, range] = None,
+    c_range: Union[int, tuple, range] = None,
+    t_range: Union[int, tuple, range] = None,
+    use_server: bool = False,
+) -> np.ndarray:
+    """Returns the projection of the image along one axis
+    Returns an array with dimensions arranged as zctyx where the projected axis has size 1
+    :param projection: The projection method. One of "max", "mean" or "sum"
+    :param axis: The axis to project along. One of "z", "y" or "x"
+    :param use_server: Project along z on the OMERO server. Only the projected planes are
+    transferred. Falls back to streaming the planes if the server projection fails
+    """
+    if use_server and axis == "z":
+        if projection not in PROJECTION_TYPES:
+            raise ValueError(
+                f"Projection {projection} is not supported. Use one of {list(PROJECTION_TYPES)}"
+            )
+        ranges = _get_intensity_ranges(
+            _get_image_shape(image), z_range, c_range, t_range
+        )
+        try:
+            return _get_server_projection(image, projection, ranges)
+        except Exception as e:
+            logger.warning(
+                f"Server projection failed for image {image.getId()}: {e}. Projecting locally"
+            )
+
+    return get_image_projections(
+        image,
+        projection=projection,
+        axes=(axis,),
+        z_range=z_range,
+        c_range=c_range,
+        t_range=t_range,
+    )[axis]
+
+
+def get_file_annotations(
+    conn: BlitzGateway,
+    object_type: str,
+    object_ids: list[int],
+    namespaces: list[str] = None,
+) -> dict[int, list[FileAnnotationWrapper]]:
+    """Fetches the file annotations linked to a set of OMERO objects.
+    The number of queries to the server does not depend on the number of objects.
+    Returns a dictionary with the file annotations indexed by the id of the object they are linked to.
+    :param object_type: The type of the parent objects. For example "Project" or "Dataset"
+    :param object_ids: The ids of the parent objects
+    :param namespaces: Only annotations whose namespace matches any of these HQL like patterns are returned
+    """
+    file_anns = {int(i): [] for i in object_ids}
+    if not file_anns:
+        return file_anns
+
+    params = ParametersI()
+    params.addIds(list(file_anns))
+    query = (
+        f"select link from {object_type}AnnotationLink as link "
+        "join fetch link.child as ann "
+        "where link.parent.id in (:ids)"
+    )
+    if namespaces:
+        ns_clauses = []
+        for i, ns in enumerate(namespaces):
+            params.addString(f"ns{i}", ns)
+            ns_clauses.append(f"ann.ns like :ns{i}")
+        query += f" and ({' or '.join(ns_clauses)})"
+
+    links = conn.getQueryService().findAllByQuery(query, params, conn.SERVICE_OPTS)
+    parent_ids = {}
+    for link in links:
+        if isinstance(link.child, FileAnnotationI):
+            parent_ids.setdefault(link.child.id.val, []).append(link.parent.id.val)
+    if not parent_ids:
+        return file_anns
+
+    # A second query loads the annotations together with their original files
+    for ann in conn.getObjects(
+        "FileAnnotation", list(parent_ids), opts={"order_by": "obj.id"}
+    ):
+        for parent_id in parent_ids[ann.getId()]:
+            file_anns[parent_id].append(ann)
+
+    return file_anns
+
+
 def get_tagged_images_in_dataset(dataset, tag_id):
     images = []
     for image in dataset.listChildren():
@@ -554,9 +857,10 @@ def create_image_from_numpy_array(
 
     # Verify if the image must be tiled
     max_plane_size = conn.getMaxPlaneSize()
-    if force_whole_planes or (
-        data.shape[-1] < max_plane_size[-1] and data.shape[-2] < max_plane_size[-2]
-    ):
+    tiled = not force_whole_planes and (
+        data.shape[-1] >= max_plane_size[-1] or data.shape[-2] >= max_plane_size[-2]
+    )
+    if not tiled:
         # Image is small enough to fill it with full planes
         new_image = conn.createImageFromNumpySeq(
             zctPlanes=zct_generator,
@@ -599,43 +903,89 @@ def create_image_from_numpy_array(
                 image_description=image_description,
             )
 
-        raw_pixel_store = conn.c.sf.createRawPixelsStore()
-        pixels_id = new_image.getPrimaryPixels().getId()
-        raw_pixel_store.setPixelsId(pixels_id, True)
-
-        for tile_coord in zct_tile_list:
-            tile_data = data[
-                tile_coord[0],
-                tile_coord[1],
-                tile_coord[2],
-                tile_coord[3][1] : tile_coord[3][1] + tile_coord[3][3],
-                tile_coord[3][0] : tile_coord[3][0] + tile_coord[3][2],
-            ]
-            tile_data = tile_data.byteswap()
-            bin_tile_data = tile_data.tostring()
-
-            raw_pixel_store.setTile(
-                bin_tile_data,
-                tile_coord[0],
-                tile_coord[1],
-                tile_coord[2],
-                tile_coord[3][0],
-                tile_coord[3][1],
-                tile_coord[3][2],
-                tile_coord[3][3],
-                conn.SERVICE_OPTS,
-            )
+    try:
+        if tiled:
+            raw_pixel_store = conn.c.sf.createRawPixelsStore()
+            pixels_id = new_image.getPrimaryPixels().getId()
+            raw_pixel_store.setPixelsId(pixels_id, True)
+            try:
+                _upload_tiles(conn, raw_pixel_store, data, zct_tile_list)
+            finally:
+                raw_pixel_store.close()
+
+            if dataset is not None:
+                _link_image_to_dataset(conn, new_image, dataset)
+
+        if channel_labels is not None:
+            _label_channels(new_image, channel_labels)
+
+        if acquisition_datetime is not None:
+            _update_acquisition_datetime(conn, new_image, acquisition_datetime)
+    except Exception:
+        # Do not leave a partly written image behind
+        _delete_created_objects(conn, "Image", [new_image.getId()])
+        raise
 
-        if dataset is not None:
-            _link_image_to_dataset(conn, new_image, dataset)
+    return new_image
 
-    if channel_labels is not None:
-        _label_channels(new_image, channel_labels)
 
-    if acquisition_datetime is not None:
-        _update_acquisition_datetime(conn, new_image, acquisition_datetime)
+def _delete_created_objects(conn: BlitzGateway, graph_spec: str, obj_ids: list[int]):
+    """Delete objects created by a call that failed afterwards.
+    Errors are logged, not raised, so they do not hide the error of the call.
+    """
+    if not obj_ids:
+        return
+    logger.warning(f"Deleting {len(obj_ids)} {graph_spec} created before an error")
+    try:
+        conn.deleteObjects(graph_spec=graph_spec, obj_ids=obj_ids, wait=True)
+    except Exception:
+        logger.exception(f"Could not delete {graph_spec} {obj_ids}")
 
-    return new_image
+
+def _upload_tiles(
+    conn: BlitzGateway,
+    raw_pixel_store,
+    data: np.ndarray,
+    zct_tile_list: list,
+    window: int = TILE_UPLOAD_WINDOW,
+):
+    """Upload the tiles of a zctyx array, keeping up to window setTile calls in flight.
+    OMERO expects big-endian pixels. Every tile is sent as the bytes of its big-endian
+    values, a type every Ice version accepts for byte sequences.
+    """
+    big_endian_dtype = data.dtype.newbyteorder(">")
+    in_flight = deque()
+    try:
+        for z, c, t, (x, y, w, h) in zct_tile_list:
+            # tobytes copies the tile in C order, whatever the layout of data
+            tile_data = (
+                data[z, c, t, y : y + h, x : x + w]
+                .astype(big_endian_dtype, copy=False)
+                .tobytes()
+            )
+            in_flight.append(
+                raw_pixel_store.begin_setTile(
+                    tile_data,
+                    z,
+                    c,
+                    t,
+                    x,
+                    y,
+                    w,
+                    h,
+                    conn.SERVICE_OPTS,
+                )
+            )
+            if len(in_flight) >= window:
+                raw_pixel_store.end_setTile(in_flight.popleft())
+        while in_flight:
+            raw_pixel_store.end_setTile(in_flight.popleft())
+    except Exception:
+        # Do not leave calls in flight when the store is closed
+        for result in in_flight:
+            with contextlib.suppress(Exception):
+                raw_pixel_store.end_setTile(result)
+        raise
 
 
 def _update_acquisition_datetime(
@@ -672,9 +1022,7 @@ def _get_tile_list(zct_list, data_shape, tile_size):
     return zct_tile_list
 
 
-def create_roi(
-    conn: BlitzGateway, image: ImageWrapper, shapes: list, name, description
-):
+def _build_roi(image: ImageWrapper, shapes: list, name, description) -> RoiI:
     # create an ROI, link it to Image
     roi = RoiI()
     # use the omero.model.ImageI that underlies the 'image' wrapper
@@ -686,12 +1034,55 @@ def create_roi(
     for shape in shapes:
         roi.addShape(shape)
 
+    return roi
+
+
+def create_roi(
+    conn: BlitzGateway, image: ImageWrapper, shapes: list, name, description
+):
+    roi = _build_roi(image, shapes, name, description)
+
     return RoiWrapper(
         conn,
         conn.getUpdateService().saveAndReturnObject(roi, conn.SERVICE_OPTS),
     )
 
 
+def create_rois(
+    conn: BlitzGateway,
+    images: list[ImageWrapper],
+    shapes: list[list],
+    names: list,
+    descriptions: list,
+    batch_size: int = ROI_BATCH_SIZE,
+) -> list[RoiWrapper]:
+    """Create ROIs persisting them batch_size at a time.
+    The ith ROI is linked to images[i] and holds shapes[i].
+    Returns the ROIs in the input order. If a batch fails, the ROIs already
+    saved are deleted.
+    """
+    rois = [
+        _build_roi(image, roi_shapes, name, description)
+        for image, roi_shapes, name, description in zip(
+            images, shapes, names, descriptions
+        )
+    ]
+    update_service = conn.getUpdateService()
+    omero_rois = []
+    try:
+        for start in range(0, len(rois), batch_size):
+            omero_rois.extend(
+                RoiWrapper(conn, roi)
+                for roi in update_service.saveAndReturnArray(
+                    rois[start : start + batch_size], conn.SERVICE_OPTS
+                )
+            )
+    except Exception:
+        _delete_created_objects(conn, "Roi", [roi.getId() for roi in omero_rois])
+        raise
+    return omero_rois
+
+
 def _rgba_to_int(rgba_color: mm_schema.Color):
     """Return the color as an Integer in RGBA encoding"""
     r = rgba_color.r << 24
@@ -947,89 +1338,273 @@ def _create_column(data_type, kwargs):
     return column_class(**kwargs)
 
 
-def _create_columns(
+def _get_table_columns(
     table: Union[DataFrame, list[dict[str, list]], dict[str, list]],
-) -> list[grid.Column]:
+) -> list[tuple[str, pd.Series]]:
     if isinstance(table, pd.DataFrame):
-        column_names = table.columns.tolist()
-        values = [table[c].values.tolist() for c in table.columns]
+        return [(str(cn), table[cn]) for cn in table.columns]
     elif isinstance(table, list):
-        column_names = [next(iter(c)) for c in table]
-        values = [table[cn] for cn in column_names]
+        return [(str(cn), pd.Series(v)) for c in table for cn, v in c.items()]
     elif isinstance(table, dict):
-        column_names = list(table.keys())
-        values = [table[cn] for cn in column_names]
+        return [(str(cn), pd.Series(v)) for cn, v in table.items()]
     elif isinstance(table, JsonObj):
-        column_names = list(table._as_dict.keys())
-        values = [table[cn] for cn in column_names]
+        return [(str(cn), pd.Series(v)) for cn, v in table._as_dict.items()]
     else:
         raise TypeError(
             "Table must be a pandas dataframe or a list of dictionaries or a dictionary"
         )
 
+
+def _create_series_column(name: str, series: pd.Series) -> Union[grid.Column, None]:
+    """Create a column from the dtype of the series.
+    Numeric values are passed to the column as numpy buffers.
+    Returns None for object columns without any value, as their type is unknown.
+    Numeric columns without any value are created as double columns of NaN.
+    """
+    missing = series.isna()
+    dtype = series.dtype
+
+    if pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+        if missing.all():
+            return None
+        inferred_type = pd.api.types.infer_dtype(series, skipna=True)
+        if inferred_type == "string":
+            # Sizes are in bytes. We leave room for longer values appended later
+            values = series.fillna("").astype(str)
+            size = max(int(values.str.encode("utf-8").str.len().max()), 1) * 2
+            return _create_column(
+                data_type="string",
+                kwargs={"name": name, "size": size, "values": values.tolist()},
+            )
+        elif inferred_type == "boolean":
+            return _create_series_column(name, series.astype("boolean"))
+        elif inferred_type == "integer":
+            return _create_series_column(name, series.astype("Int64"))
+        elif inferred_type in ("floating", "mixed-integer-float", "decimal"):
+            return _create_series_column(name, series.astype(np.float64))
+        first_value = series[~missing].iloc[0]
+        if isinstance(first_value, (ImageWrapper, ImageI)):
+            values = np.array([img.getId() for img in series], dtype=np.int64)
+            return _create_column("image", kwargs={"name": name, "values": values})
+        elif isinstance(first_value, (RoiWrapper, RoiI)):
+            values = np.array([roi.getId() for roi in series], dtype=np.int64)
+            return _create_column("roi", kwargs={"name": name, "values": values})
+        elif isinstance(first_value, (list, tuple)):  # We are creating array columns
+            raise NotImplementedError(
+                f"Array columns are not implemented. Column {name}"
+            )
+        raise TypeError(
+            f"Could not detect column datatype {type(first_value)} for column {name}"
+        )
+
+    id_type = ID_COLUMN_NAMES.get(name.lower())
+    if id_type is not None:
+        # A double column would silently lose the link to the OMERO objects
+        if missing.any():
+            raise ValueError(
+                f"Column {name} holds {id_type} ids but has "
+                f"{int(missing.sum())} missing values. "
+                f"Drop or fill those rows before saving the table"
+            )
+        if pd.api.types.is_float_dtype(dtype):
+            if not np.all(np.mod(series.to_numpy(dtype=np.float64), 1) == 0):
+                raise ValueError(
+                    f"Column {name} holds {id_type} ids but has non-integer values"
+                )
+            series = series.astype(np.int64)
+            dtype = series.dtype
+
+    if missing.any():
+        # OMERO.tables have no missing values for integers. We fall back to NaN
+        data_type = "double"
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    elif pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        data_type = ID_COLUMN_NAMES.get(name.lower(), "long")
+        values = series.to_numpy(dtype=np.int64)
+    elif pd.api.types.is_float_dtype(dtype):
+        data_type = "double"
+        values = series.to_numpy(dtype=np.float64)
+    else:
+        raise TypeError(
+            f"Could not detect column datatype {dtype} for column {name}"
+        )
+
+    return _create_column(
+        data_type=data_type,
+        kwargs={"name": name, "values": np.ascontiguousarray(values)},
+    )
+
+
+def _create_columns(
+    table: Union[DataFrame, list[dict[str, list]], dict[str, list]],
+) -> list[grid.Column]:
+    columns = []
+    for cn, series in _get_table_columns(table):
+        column = _create_series_column(cn, series)
+        if column is not None:
+            columns.append(column)
+
+    return columns
+
+
+def _iter_table_chunks(
+    table: Union[DataFrame, list[dict[str, list]], dict[str, list], Iterator],
+) -> Iterator[DataFrame]:
+    if isinstance(table, Iterator):
+        for chunk in table:
+            yield from _iter_table_chunks(chunk)
+    elif isinstance(table, pd.DataFrame):
+        yield table
+    else:
+        yield pd.DataFrame(dict(_get_table_columns(table)))
+
+
+def _empty_column(column: grid.Column) -> grid.Column:
+    """Returns a column of the same type, name and size as column, without values"""
+    kwargs = {"name": column.name, "values": []}
+    if isinstance(column, grid.StringColumn):
+        kwargs["size"] = column.size
+    return type(column)(**kwargs)
+
+
+def _create_header_columns(
+    table: DataFrame, headers: list[grid.Column]
+) -> list[grid.Column]:
+    """Create the columns of a table with the names and types of the headers of
+    an existing table. Raises a ValueError if the rows can not be written to it.
+    """
+    series_by_name = dict(_get_table_columns(table))
+    extra_names = [
+        name
+        for name, series in series_by_name.items()
+        if name not in {h.name for h in headers} and not series.isna().all()
+    ]
+    if extra_names:
+        raise ValueError(
+            f"Columns {extra_names} are not in the table {[h.name for h in headers]}"
+        )
+
+    integer_types = (
+        grid.LongColumn,
+        *{COLUMN_TYPES[t] for t in ID_COLUMN_NAMES.values()},
+    )
     columns = []
-    for cn, v in zip(column_names, values):
-        v_type = type(v[0])
-        if isinstance(v[0], str):
-            size = (
-                len(max(v, key=len)) * 2
-            )  # We assume here that the max size is double of what we really have...
-            args = {"name": cn, "size": size, "values": v}
-            columns.append(_create_column(data_type="string", kwargs=args))
-        elif isinstance(v[0], (int, np.integer)):
-            if cn.lower() in ["imageid", "image id", "image_id"]:
-                args = {"name": cn, "values": v}
-                columns.append(_create_column(data_type="image", kwargs=args))
-            elif cn.lower() in ["datasetid", "dataset id", "dataset_id"]:
-                args = {"name": cn, "values": v}
-                columns.append(_create_column(data_type="dataset", kwargs=args))
-            elif cn.lower() in ["plateid", "plate id", "plate_id"]:
-                args = {"name": cn, "values": v}
-                columns.append(_create_column(data_type="plate", kwargs=args))
-            elif cn.lower() in ["wellid", "well id", "well_id"]:
-                args = {"name": cn, "values": v}
-                columns.append(_create_column(data_type="well", kwargs=args))
-            elif cn.lower() in ["roiid", "roi id", "roi_id"]:
-                args = {"name": cn, "values": v}
-                columns.append(_create_column(data_type="roi", kwargs=args))
-            elif cn.lower() in ["mask", "maskid", "mask id", "mask_id"]:
-                args = {"name": cn, "values": v}
-                columns.append(_create_column(data_type="mask", kwargs=args))
-            elif cn.lower() in ["fileid", "file id", "file_id"]:
-                args = {"name": cn, "values": v}
-                columns.append(_create_column(data_type="file", kwargs=args))
+    for header in headers:
+        if header.name not in series_by_name:
+            raise ValueError(f"Column {header.name} of the table is missing")
+        series = series_by_name[header.name]
+        n_rows = len(series)
+        header_type = type(header).__name__
+        column = None
+        if not series.isna().all():
+            column = _create_series_column(header.name, series)
+        if column is None:
+            # Only doubles and strings can hold missing values
+            if isinstance(header, grid.DoubleColumn):
+                values = np.full(n_rows, np.nan)
+            elif isinstance(header, grid.StringColumn):
+                values = [""] * n_rows
             else:
-                args = {"name": cn, "values": v}
-                columns.append(_create_column(data_type="long", kwargs=args))
-        elif isinstance(v[0], (float, np.floating)):
-            args = {"name": cn, "values": v}
-            columns.append(_create_column(data_type="double", kwargs=args))
-        elif isinstance(v[0], (bool, np.bool_)):
-            args = {"name": cn, "values": [int(i) for i in v]}
-            columns.append(_create_column(data_type="long", kwargs=args))
-        elif isinstance(v[0], (ImageWrapper, ImageI)):
-            args = {"name": cn, "values": [img.getId() for img in v]}
-            columns.append(_create_column(data_type="image", kwargs=args))
-        elif isinstance(v[0], (RoiWrapper, RoiI)):
-            args = {"name": cn, "values": [roi.getId() for roi in v]}
-            columns.append(_create_column(data_type="roi", kwargs=args))
-        elif isinstance(v_type, (list, tuple)):  # We are creating array columns
-            raise NotImplementedError(
-                f"Array columns are not implemented. Column {cn}"
+                raise ValueError(
+                    f"Column {header.name} has no values but {header_type} "
+                    f"can not hold missing values"
+                )
+        elif isinstance(header, type(column)):
+            values = column.values
+        elif isinstance(header, grid.DoubleColumn) and isinstance(
+            column, (grid.BoolColumn, *integer_types)
+        ):
+            values = np.asarray(column.values, dtype=np.float64)
+        elif isinstance(header, integer_types) and isinstance(column, integer_types):
+            # ID columns named otherwise than in ID_COLUMN_NAMES are created as longs
+            values = np.asarray(column.values, dtype=np.int64)
+        elif isinstance(header, integer_types) and isinstance(
+            column, grid.DoubleColumn
+        ):
+            raise ValueError(
+                f"Column {header.name} has missing or non-integer values "
+                f"but {header_type} can only hold integers"
             )
-        elif v[0] is None:
-            continue
         else:
-            raise TypeError(
-                f"Could not detect column datatype {v_type} for column {cn}"
+            raise ValueError(
+                f"Column {header.name} is a {type(column).__name__} "
+                f"but the table column is a {header_type}"
             )
+        if isinstance(header, grid.StringColumn):
+            longest = max((len(v.encode("utf-8")) for v in values), default=0)
+            if longest > header.size:
+                raise ValueError(
+                    f"Column {header.name} has values of {longest} bytes "
+                    f"but the table column holds {header.size} bytes"
+                )
+        header_column = _empty_column(header)
+        header_column.values = values
+        columns.append(header_column)
 
     return columns
 
 
+def _add_table_rows(
+    table,
+    headers: list[grid.Column],
+    columns: list[grid.Column],
+    row_batch_size: int,
+    attempts: int,
+):
+    """Add the rows of columns to an open table, row_batch_size rows at a time.
+    Calls failing on a transient error are retried unless the rows turn out to have
+    been written.
+    """
+    headers = {h.name: h for h in headers}
+    if set(headers) != {c.name for c in columns}:
+        raise ValueError(
+            f"Columns {sorted(c.name for c in columns)} do not match "
+            f"the columns of the table {sorted(headers)}"
+        )
+    n_rows = len(columns[0].values)
+    start_rows = table.getNumberOfRows()
+    for start in range(0, n_rows, row_batch_size):
+        stop = min(start + row_batch_size, n_rows)
+        for column in columns:
+            headers[column.name].values = column.values[start:stop]
+        for attempt in range(attempts):
+            try:
+                table.addData(list(headers.values()))
+                break
+            except TABLE_WRITE_RETRY_ERRORS as e:
+                if table.getNumberOfRows() >= start_rows + stop:
+                    # The call failed after the rows were written
+                    break
+                if attempt == attempts - 1:
+                    raise e
+                logger.warning(f"Retrying to write rows {start} to {stop}: {e}")
+
+
+def _find_table_annotation(
+    conn: BlitzGateway,
+    omero_object: Union[ImageWrapper, DatasetWrapper, ProjectWrapper],
+    table_name: str,
+    namespace: str,
+) -> Union[FileAnnotationWrapper, None]:
+    """Returns the last table named table_name by create_table on omero_object"""
+    file_anns = get_file_annotations(
+        conn,
+        omero_object.OMERO_CLASS,
+        [omero_object.getId()],
+        namespaces=[namespace] if namespace is not None else None,
+    )[omero_object.getId()]
+    tables = [
+        ann
+        for ann in file_anns
+        if ann.getFile().getName().startswith(f"{table_name}_")
+        and ann.getFile().getName().endswith(".h5")
+    ]
+    return max(tables, key=lambda ann: ann.getId(), default=None)
+
+
 def create_table(
     conn: BlitzGateway,
-    table: Union[DataFrame, list[dict[str, list]], dict[str, list]],
+    table: Union[DataFrame, list[dict[str, list]], dict[str, list], Iterator],
     table_name: str,
     omero_object: Union[
         ImageWrapper,
@@ -1039,26 +1614,94 @@ def create_table(
     ],
     table_description: str,
     namespace: str,
+    append_to_existing: bool = False,
+    row_batch_size: int = TABLE_ROW_BATCH_SIZE,
+    attempts: int = TABLE_WRITE_ATTEMPTS,
 ):
-    """Creates a table annotation from a pandas dataframe or a list of columns as dictionaries."""
+    """Creates a table annotation from a pandas dataframe or a list of columns as dictionaries.
+    The table may also be an iterator of those, written one chunk at a time.
+    Rows are sent row_batch_size at a time. If the write fails, the new table is deleted.
+    With append_to_existing, the rows are added to the last table created with the same
+    name and namespace on the (first) object, if there is one.
+    """
     # We need to change the connection group in order to be able to save the table.
     if isinstance(omero_object, list):
         group_id = omero_object[0].getDetails().getGroup().getId()
     else:
         group_id = omero_object.getDetails().getGroup().getId()
+    resources = conn.c.sf.sharedResources()
+
+    if append_to_existing:
+        file_ann = _find_table_annotation(
+            conn,
+            omero_object[0] if isinstance(omero_object, list) else omero_object,
+            table_name,
+            namespace,
+        )
+        if file_ann is not None:
+            omero_table = resources.openTable(
+                OriginalFileI(file_ann.getFile().getId(), False),
+                {"omero.group": str(group_id)},
+            )
+            try:
+                headers = omero_table.getHeaders()
+                for chunk in _iter_table_chunks(table):
+                    _add_table_rows(
+                        omero_table,
+                        headers,
+                        _create_header_columns(chunk, headers),
+                        row_batch_size,
+                        attempts,
+                    )
+            finally:
+                omero_table.close()
+            return file_ann
+
     table_name = (
         f'{table_name}_{"".join([choice(ascii_letters) for _ in range(32)])}.h5'
     )
-    columns = _create_columns(table)
-    resources = conn.c.sf.sharedResources()
+    chunks = _iter_table_chunks(table)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        raise ValueError(f"Table {table_name} has no data")
+    columns = _create_columns(first_chunk)
     repository_id = resources.repositories().descriptions[0].getId().getValue()
-    table = resources.newTable(
+    omero_table = resources.newTable(
         repository_id, table_name, {"omero.group": str(group_id)}
     )
-    table.initialize(columns)
-    table.addData(columns)
-    original_file = table.getOriginalFile()
-    table.close()
+    original_file = None
+    try:
+        original_file = omero_table.getOriginalFile()
+        # Rows are only sent by _add_table_rows, in batches
+        omero_table.initialize([_empty_column(column) for column in columns])
+        headers = omero_table.getHeaders()
+        _add_table_rows(omero_table, headers, columns, row_batch_size, attempts)
+        for chunk in chunks:
+            _add_table_rows(
+                omero_table,
+                headers,
+                _create_header_columns(chunk, headers),
+                row_batch_size,
+                attempts,
+            )
+    except Exception as e:
+        logger.error(f"Error writing table {table_name}. Deleting it: {e}")
+        with contextlib.suppress(Exception):
+            omero_table.close()
+        if original_file is not None:
+            # A failing cleanup must not hide the error writing the table
+            try:
+                conn.deleteObjects(
+                    graph_spec="OriginalFile",
+                    obj_ids=[original_file.id.val],
+                    wait=True,
+                )
+            except Exception:
+                logger.exception(
+                    f"Could not delete table {table_name} ({original_file.id.val})"
+                )
+        raise
+    omero_table.close()
 
     file_ann = FileAnnotationWrapper(conn)
     if namespace is not None:
@@ -1126,6 +1769,78 @@ def create_file(
     return file_ann
 
 
+class _BufferReader(io.RawIOBase):
+    """A raw binary stream reading from a buffer without copying it"""
+
+    def __init__(self, buffer: Union[bytes, bytearray, memoryview]):
+        self._view = memoryview(buffer)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self._view) - self._position)
+        b[:n] = self._view[self._position : self._position + n]
+        self._position += n
+        return n
+
+
+def read_file_annotation(
+    file_ann: FileAnnotationWrapper, chunk_size: int = FILE_CHUNK_SIZE
+) -> bytearray:
+    """Reads the whole content of a file annotation.
+    The chunks are copied into a single buffer preallocated from the size of the original file.
+    """
+    file_size = file_ann.getFileSize()
+    buffer = bytearray(file_size)
+    offset = 0
+    for chunk in file_ann.getFileInChunks(buf=chunk_size):
+        buffer[offset : offset + len(chunk)] = chunk
+        offset += len(chunk)
+    if offset != file_size:
+        raise IOError(
+            f"File annotation {file_ann.getId()}: {offset} bytes read but the file size is {file_size}"
+        )
+    return buffer
+
+
+def get_file_fingerprint(file_ann: FileAnnotationWrapper) -> dict:
+    """Returns the id and hash of the original file of a file annotation.
+    The hash changes if the content of the file is replaced.
+    """
+    original_file = file_ann.getFile()
+    return {"file_id": original_file.getId(), "hash": original_file.getHash()}
+
+
+@contextlib.contextmanager
+def open_raw_file_store(file_ann: FileAnnotationWrapper):
+    """Opens a raw file store on the file of a file annotation.
+    Use it to read byte ranges of a file with store.read(offset, length)
+    """
+    conn = file_ann._conn
+    store = conn.createRawFileStore()
+    try:
+        store.setFileId(file_ann.getFile().getId(), conn.SERVICE_OPTS)
+        yield store
+    finally:
+        store.close()
+
+
+def open_file_annotation(
+    file_ann: FileAnnotationWrapper,
+    chunk_size: int = FILE_CHUNK_SIZE,
+    encoding: str = "utf-8",
+) -> io.TextIOWrapper:
+    """Returns a text stream over the content of a file annotation.
+    Parsers can consume the stream incrementally without a decoded copy of the whole file.
+    """
+    return io.TextIOWrapper(
+        io.BufferedReader(_BufferReader(read_file_annotation(file_ann, chunk_size))),
+        encoding=encoding,
+    )
+
+
 def _link_annotation(
     object_wrapper: Union[ImageWrapper, DatasetWrapper, ProjectWrapper],
     annotation_wrapper: Union[
@@ -199,19 +199,20 @@ def dump_output_element(
 ) -> None:
     if isinstance(output_element, list):
         for e in output_element:
-            dump_output_element(e, target_omero_object)
+            dump_output_element(e, target_omero_object, append_to_existing, as_table)
     else:
         logger.info(f"Dumping {output_element.class_name} to OMERO")
         conn = target_omero_object._conn
+        if isinstance(output_element, mm_schema.Table):
+            return dump.dump_table(
+                conn,
+                output_element,
+                target_omero_object,
+                append_to_existing=append_to_existing,
+            )
         for t, f in OBJECT_TO_DUMP_FUNCTION.items():
             if isinstance(output_element, t):
-                return f(
-                    conn,
-                    output_element,
-                    target_omero_object,
-                    append_to_existing,
-                    as_table,
-                )
+                return f(conn, output_element, target_omero_object)
 
         logger.info(
             f"{output_element.class_name} output could not be dumped to OMERO"
@@ -4,46 +4,254 @@ Handles microscopemetrics schema objects, pandas dataframes and NumPy arrays for
 """
 
 import base64
+import functools
+import hashlib
+import json
+import zlib
 from dataclasses import fields
-from typing import Any, Dict
+from typing import Any, Dict, Optional, Union
 
 import numpy as np
 import pandas as pd
 from microscopemetrics_schema.datamodel import microscopemetrics_schema as mm_schema
 
+from omero_metrics.tools.cache import get_blob_store, get_context_cache
+
 # Marker keys for custom types
 NUMPY_MARKER = "__numpy_array__"
 MM_SCHEMA_MARKER = "__mm_schema_obj__"
+MM_SCHEMA_ENUM_MARKER = "__mm_schema_enum__"
 DATAFRAME_MARKER = "__dataframe__"
+# Key stamped by serialize with the hash and size of a serialized dictionary
+HASH_MARKER = "__hash__"
 
+# Arrays from this size on are kept in the blob store and only referenced in the session
+BLOB_THRESHOLD_BYTES = 64 * 1024
 
-def serialize_numpy(arr: np.ndarray) -> Dict[str, Any]:
-    """Serialize NumPy array to a JSON-compatible dictionary using binary encoding."""
-    return {
+# Compression codecs for the arrays kept in the session: name -> (compress, decompress)
+NUMPY_CODECS = {
+    "zlib": (lambda data: zlib.compress(data, 1), zlib.decompress),
+}
+
+# Integer dtypes tried by _narrow_dtype, smallest first
+NARROW_DTYPES = [
+    np.dtype(t) for t in ("uint8", "int8", "uint16", "int16", "uint32", "int32")
+]
+
+
+def _narrow_dtype(arr: np.ndarray) -> np.dtype:
+    """Returns the smallest integer dtype holding all the values of the array without loss.
+    Returns the dtype of the array if there is none smaller, e.g. for floats with decimals.
+    """
+    if arr.size == 0 or arr.dtype.kind not in "iuf":
+        return arr.dtype
+    if arr.dtype.kind == "f" and not (
+        np.all(np.isfinite(arr)) and np.array_equal(arr, np.trunc(arr))
+    ):
+        return arr.dtype
+    low, high = int(arr.min()), int(arr.max())
+    for narrow_dtype in NARROW_DTYPES:
+        if narrow_dtype.itemsize >= arr.dtype.itemsize:
+            break
+        info = np.iinfo(narrow_dtype)
+        if info.min <= low and high <= info.max:
+            return narrow_dtype
+    return arr.dtype
+
+
+def serialize_numpy(
+    arr: np.ndarray,
+    blob_threshold: Optional[int] = BLOB_THRESHOLD_BYTES,
+    codec: Optional[str] = None,
+    narrow_dtype: bool = False,
+) -> Dict[str, Any]:
+    """Serialize NumPy array to a JSON-compatible dictionary using binary encoding.
+    If narrow_dtype, the array is stored with the smallest dtype that holds its values
+    without loss. Arrays of blob_threshold bytes or more, once narrowed, are stored in the
+    blob store and only their key is kept. The arrays kept in the dictionary may be
+    compressed with one of NUMPY_CODECS.
+    """
+    result = {
         NUMPY_MARKER: True,
         "dtype": str(arr.dtype),
         "shape": list(arr.shape),
-        "data": base64.b64encode(arr.tobytes()).decode("ascii"),
     }
+    if narrow_dtype:
+        stored_dtype = _narrow_dtype(arr)
+        if stored_dtype != arr.dtype:
+            arr = arr.astype(stored_dtype)
+            result["stored_dtype"] = str(stored_dtype)
+    if blob_threshold is not None and arr.nbytes >= blob_threshold:
+        result["blob"] = get_blob_store().put(arr)
+        return result
+    data = arr.tobytes()
+    if codec is not None:
+        if codec not in NUMPY_CODECS:
+            raise ValueError(
+                f"Unknown codec {codec}. Use one of {list(NUMPY_CODECS)}"
+            )
+        data = NUMPY_CODECS[codec][0](data)
+        result["codec"] = codec
+    result["data"] = base64.b64encode(data).decode("ascii")
+    return result
+
+
+def has_blobs(obj: Any) -> bool:
+    """Returns whether all the arrays referenced by a serialized object are in the blob store"""
+    if isinstance(obj, dict):
+        if NUMPY_MARKER in obj:
+            return "blob" not in obj or get_blob_store().has(obj["blob"])
+        return all(has_blobs(v) for v in obj.values())
+    elif isinstance(obj, list):
+        return all(has_blobs(item) for item in obj)
+    return True
 
 
 def deserialize_numpy(d: Dict[str, Any]) -> np.ndarray:
-    """Deserialize a dictionary back to a NumPy array."""
-    data = base64.b64decode(d["data"])
-    return np.frombuffer(data, dtype=d["dtype"]).reshape(d["shape"])
+    """Deserialize a dictionary back to a read-only NumPy array.
+    Arrays in the blob store are returned as read-only memmaps, unless they were
+    narrowed: these are converted back to their dtype in memory.
+    """
+    if "blob" in d:
+        arr = get_blob_store().get(d["blob"])
+    else:
+        data = base64.b64decode(d["data"])
+        if "codec" in d:
+            data = NUMPY_CODECS[d["codec"]][1](data)
+        arr = np.frombuffer(data, dtype=d.get("stored_dtype", d["dtype"]))
+        arr = arr.reshape(d["shape"])
+    if "stored_dtype" in d:
+        arr = arr.astype(d["dtype"])
+        arr.flags.writeable = False
+    return arr
+
+
+def _serialize_column(
+    values: Union[pd.Series, pd.Index], numpy_options: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Serialize a column or an index. NumPy dtypes are encoded as NumPy arrays."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = pd.Categorical(values)
+        return {
+            "codes": serialize_numpy(values.codes, **numpy_options),
+            "categories": _serialize_column(values.categories, numpy_options),
+            "ordered": values.ordered,
+        }
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        # Timestamps are not JSON serializable. They are encoded as UTC datetimes
+        utc = pd.DatetimeIndex(values).tz_convert("UTC").tz_localize(None)
+        return {
+            "tz": str(values.dtype.tz),
+            "utc": serialize_numpy(utc.to_numpy(), **numpy_options),
+        }
+    if isinstance(values.dtype, np.dtype) and values.dtype.kind in "biufcmM":
+        return serialize_numpy(
+            np.ascontiguousarray(values.to_numpy()), **numpy_options
+        )
+    # Missing values, e.g. pd.NA, are stored as None
+    missing = values.isna()
+    return {
+        "dtype": str(values.dtype),
+        "values": values.astype(object).where(~missing, None).tolist(),
+    }
+
+
+def _deserialize_column(
+    d: Dict[str, Any],
+) -> Union[np.ndarray, pd.api.extensions.ExtensionArray]:
+    """Deserialize a column or an index."""
+    if NUMPY_MARKER in d:
+        return deserialize_numpy(d)
+    if "codes" in d:
+        return pd.Categorical.from_codes(
+            deserialize_numpy(d["codes"]),
+            categories=_deserialize_column(d["categories"]),
+            ordered=d["ordered"],
+        )
+    if "tz" in d:
+        utc = pd.DatetimeIndex(deserialize_numpy(d["utc"])).tz_localize("UTC")
+        return utc.tz_convert(d["tz"]).array
+    if d["dtype"] == "object":
+        # Kept as a read-only NumPy array as the frames may be shared by deserialize
+        values = np.empty(len(d["values"]), dtype=object)
+        values[:] = d["values"]
+        values.flags.writeable = False
+        return values
+    return pd.array(d["values"], dtype=d["dtype"])
 
 
-def serialize_dataframe(df: pd.DataFrame) -> Dict[str, Any]:
-    """Serialize pandas DataFrame to a JSON-compatible dictionary."""
+def serialize_dataframe(
+    df: pd.DataFrame, numpy_options: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Serialize pandas DataFrame to a JSON-compatible dictionary.
+    The frame is encoded column by column, so that dtypes round-trip exactly.
+    numpy_options are passed to serialize_numpy for the numerical columns.
+    """
+    numpy_options = numpy_options or {}
+    if isinstance(df.index, pd.RangeIndex):
+        index = {
+            "start": df.index.start,
+            "stop": df.index.stop,
+            "step": df.index.step,
+        }
+    else:
+        index = _serialize_column(df.index, numpy_options)
     return {
         DATAFRAME_MARKER: True,
-        "data": df.to_dict(orient="split"),
+        "columns": df.columns.tolist(),
+        "index": index,
+        "index_name": df.index.name,
+        "data": [
+            _serialize_column(df.iloc[:, i], numpy_options)
+            for i in range(df.shape[1])
+        ],
     }
 
 
 def deserialize_dataframe(d: Dict[str, Any]) -> pd.DataFrame:
-    """Deserialize a dictionary back to a pandas DataFrame."""
-    return pd.DataFrame(**d["data"])
+    """Deserialize a dictionary back to a pandas DataFrame.
+    The NumPy columns are read-only, they are not copied from the decoded arrays.
+    """
+    if "columns" not in d:
+        # Frames serialized with to_dict(orient="split")
+        return pd.DataFrame(**d["data"])
+    if "start" in d["index"]:
+        index = pd.RangeIndex(
+            d["index"]["start"],
+            d["index"]["stop"],
+            d["index"]["step"],
+            name=d["index_name"],
+        )
+    else:
+        index = pd.Index(_deserialize_column(d["index"]), name=d["index_name"])
+    df = pd.DataFrame(
+        {i: _deserialize_column(column) for i, column in enumerate(d["data"])},
+        index=index,
+        copy=False,
+    )
+    df.columns = d["columns"]
+    return df
+
+
+@functools.lru_cache(maxsize=None)
+def _get_field_names(cls: type) -> tuple[str, ...]:
+    """Returns the names of the fields of a schema class. Cached per class."""
+    return tuple(field.name for field in fields(cls))
+
+
+def _build_mm_schema_obj(
+    class_name: str, data: Dict[str, Any]
+) -> mm_schema.YAMLRoot:
+    """Builds a schema object from data produced by serialize.
+    The data comes from a valid object so the LinkML validation in __post_init__ is skipped.
+    Data with other fields than the class, e.g. from an older version of the schema, is validated.
+    """
+    cls = getattr(mm_schema, class_name)
+    if set(data) != set(_get_field_names(cls)):
+        return cls(**data)
+    obj = cls.__new__(cls)
+    obj.__dict__.update(data)
+    return obj
 
 
 def serialize_mm_schema_obj(obj: mm_schema.YAMLRoot) -> Dict[str, Any]:
@@ -54,41 +262,171 @@ def serialize_mm_schema_obj(obj: mm_schema.YAMLRoot) -> Dict[str, Any]:
     }
 
 
-def serialize(obj: Any) -> Any:
+def _content_hash(value: Any) -> tuple[str, int]:
+    content = json.dumps(value, sort_keys=True, separators=(",", ":"), default=repr)
+    content = content.encode()
+    return hashlib.sha256(content).hexdigest(), len(content)
+
+
+def _stamp(d: Dict[str, Any]) -> Dict[str, Any]:
+    """Stamps a serialized dictionary and the dictionaries it contains with the hash
+    and size of their content. Every value is encoded once: the hash of the dictionary
+    combines the hashes of its values.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    for key in sorted(d, key=str):
+        value_hash, value_size = _content_hash(d[key])
+        if isinstance(d[key], dict):
+            d[key][HASH_MARKER] = {"hash": value_hash, "size": value_size}
+        digest.update(f"{json.dumps(str(key))}:{value_hash},".encode())
+        size += value_size
+    d[HASH_MARKER] = {"hash": digest.hexdigest(), "size": size}
+    return d
+
+
+def serialize(
+    obj: Any,
+    blob_threshold: Optional[int] = BLOB_THRESHOLD_BYTES,
+    codec: Optional[str] = None,
+    narrow_dtype: bool = False,
+) -> Any:
+    """
+    Serialize an object for JSON storage in session_state.
+
+    A dictionary result and the dictionaries it contains are stamped with a content
+    hash so that deserialize can reuse previous results.
+
+    Args:
+        obj: The object to serialize
+        blob_threshold: Size in bytes from which arrays are kept out of the session.
+            None keeps all arrays in the session.
+        codec: Compression codec, from NUMPY_CODECS, of the arrays kept in the session
+        narrow_dtype: Store the arrays kept in the session with the smallest lossless dtype
+    """
+    result = _serialize(
+        obj,
+        {
+            "blob_threshold": blob_threshold,
+            "codec": codec,
+            "narrow_dtype": narrow_dtype,
+        },
+    )
+    if isinstance(result, dict):
+        _stamp(result)
+    return result
+
+
+def _serialize(obj: Any, numpy_options: Dict[str, Any]) -> Any:
     """
     Recursively serialize an object for JSON storage in session_state.
 
     Handles:
-    - NumPy arrays (binary encoded)
+    - NumPy arrays (binary encoded or referenced in the blob store)
     - Pandas DataFrames
     - MetricsObject
     - Nested structures (lists, dicts)
     """
     if isinstance(obj, np.ndarray):
-        return serialize_numpy(obj)
+        return serialize_numpy(obj, **numpy_options)
     elif isinstance(obj, pd.DataFrame):
-        return serialize_dataframe(obj)
+        return serialize_dataframe(obj, numpy_options)
     elif isinstance(obj, mm_schema.EnumDefinitionImpl):
-        return str(obj)
+        # Enums are rebuilt on deserialization as the validation that converts them is skipped
+        return {MM_SCHEMA_ENUM_MARKER: type(obj).__name__, "code": str(obj)}
     elif isinstance(obj, mm_schema.YAMLRoot):
         # Serialize microscopemetrics_object but also process its fields recursively
-        result = {
+        return {
             MM_SCHEMA_MARKER: obj.class_name,
-            "data": {},
+            "trusted": True,
+            "data": {
+                name: _serialize(getattr(obj, name), numpy_options)
+                for name in _get_field_names(type(obj))
+            },
         }
-        for field in fields(obj):
-            value = getattr(obj, field.name)
-            result["data"][field.name] = serialize(value)
-        return result
     elif isinstance(obj, dict):
-        return {k: serialize(v) for k, v in obj.items()}
+        return {k: _serialize(v, numpy_options) for k, v in obj.items()}
     elif isinstance(obj, (list, tuple)):
-        return [serialize(item) for item in obj]
+        return [_serialize(item, numpy_options) for item in obj]
     else:
         return obj
 
 
 def deserialize(obj: Any) -> Any:
+    """
+    Deserialize an object from JSON storage.
+
+    Objects stamped by serialize are deserialized once per process and kept in the
+    context cache. Every caller gets its own copy of the containers, DataFrames and
+    schema objects, so that changes made by a caller are not seen by the next ones.
+    The copies share the cached NumPy arrays, which are read-only.
+
+    Args:
+        obj: The object to deserialize
+    """
+    if not isinstance(obj, dict) or HASH_MARKER not in obj:
+        return _copy_shared(_deserialize(obj))
+
+    key = obj[HASH_MARKER]["hash"]
+    value = get_context_cache().get(key)
+    if value is None:
+        value = _deserialize(obj)
+        get_context_cache().put(key, value, obj[HASH_MARKER]["size"])
+    return _copy_shared(value)
+
+
+def _copy_shared(obj: Any) -> Any:
+    """
+    Copy a deserialized object without copying its data.
+
+    DataFrames are shallow copies over read-only arrays: with copy-on-write the writes
+    go to the copy, otherwise writing to the values raises.
+
+    Args:
+        obj: The deserialized object
+    """
+    if isinstance(obj, pd.DataFrame):
+        return obj.copy(deep=False)
+    elif isinstance(obj, mm_schema.EnumDefinitionImpl):
+        return obj
+    elif isinstance(obj, mm_schema.YAMLRoot):
+        copy = type(obj).__new__(type(obj))
+        copy.__dict__.update({k: _copy_shared(v) for k, v in obj.__dict__.items()})
+        return copy
+    elif isinstance(obj, dict):
+        return {k: _copy_shared(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [_copy_shared(item) for item in obj]
+    else:
+        # NumPy arrays are read-only
+        return obj
+
+
+def deserialize_path(obj: Any, path: str) -> Any:
+    """
+    Deserialize only the entry of a serialized object found at a key path.
+
+    The path is made of dot separated keys, attribute names and list indices, e.g.
+    "mm_image.channel_series" or "mm_dataset.output.key_measurements.0". The other
+    entries of the object are not deserialized.
+
+    Args:
+        obj: The serialized object
+        path: The key path of the entry to deserialize
+    """
+    for key in path.split("."):
+        if isinstance(obj, list):
+            obj = obj[int(key)]
+        elif isinstance(obj, dict) and MM_SCHEMA_MARKER in obj:
+            obj = obj["data"][key]
+        elif isinstance(obj, dict):
+            obj = obj[key]
+        else:
+            raise KeyError(f"{key} in path {path} cannot be resolved")
+    return deserialize(obj)
+
+
+def _deserialize(obj: Any) -> Any:
     """
     Recursively deserialize an object from JSON storage.
 
@@ -100,15 +438,23 @@ def deserialize(obj: Any) -> Any:
             return deserialize_numpy(obj)
         elif DATAFRAME_MARKER in obj:
             return deserialize_dataframe(obj)
+        elif MM_SCHEMA_ENUM_MARKER in obj:
+            return getattr(mm_schema, obj[MM_SCHEMA_ENUM_MARKER])(obj["code"])
         elif MM_SCHEMA_MARKER in obj:
             class_name = obj[MM_SCHEMA_MARKER]
-            data = {k: deserialize(v) for k, v in obj["data"].items()}
+            data = {
+                k: _deserialize(v)
+                for k, v in obj["data"].items()
+                if k != HASH_MARKER
+            }
 
+            if obj.get("trusted"):
+                return _build_mm_schema_obj(class_name, data)
             return getattr(mm_schema, class_name)(**data)
 
         else:
-            return {k: deserialize(v) for k, v in obj.items()}
+            return {k: _deserialize(v) for k, v in obj.items() if k != HASH_MARKER}
     elif isinstance(obj, list):
-        return [deserialize(item) for item in obj]
+        return [_deserialize(item) for item in obj]
     else:
         return obj
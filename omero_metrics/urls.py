@@ -27,6 +27,8 @@ from omero_metrics.views import (
     center_viewer_group,
     center_viewer_image,
     center_viewer_project,
+    download_dataset,
+    download_project,
     imageJ,
     index,
     microscope_view,
@@ -45,6 +47,16 @@ urlpatterns = [
         name="dataset",
     ),
     re_path(r"^group/", center_viewer_group, name="group"),
+    re_path(
+        r"^download/dataset/(?P<dataset_id>[0-9]+)/",
+        download_dataset,
+        name="download_dataset",
+    ),
+    re_path(
+        r"^download/project/(?P<project_id>[0-9]+)/",
+        download_project,
+        name="download_project",
+    ),
     re_path(r"^image/(?P<image_id>[0-9]+)/", center_viewer_image, name="image"),
     re_path(
         r"^omero_metrics_projects/",
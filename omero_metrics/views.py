@@ -3,10 +3,12 @@ import traceback
 from datetime import datetime
 
 import omero
+from django.http import HttpResponseBadRequest
 from django.shortcuts import render
 from microscopemetrics import AnalysisError, SaturationError
 from microscopemetrics_schema import datamodel as mm_schema
 from omero.gateway import FileAnnotationWrapper
+from omeroweb.http import ConnCleaningHttpResponse
 from omeroweb.webclient.decorators import login_required
 
 from omero_metrics.tools import (
@@ -14,9 +16,11 @@ from omero_metrics.tools import (
     data_type,
     delete,
     dump,
+    export,
     load,
     omero_tools,
 )
+from omero_metrics.tools.context_store import store_context
 from omero_metrics.tools.data_type import TEMPLATE_MAPPINGS_DATASET
 from omero_metrics.tools.serializers import serialize
 
@@ -37,6 +41,60 @@ def index(request, conn=None, **kwargs):
     return render(request, "omero_metrics/top_link_template/index.html", context)
 
 
+def _load_group_context(conn, group_id: int) -> dict:
+    file_ann, map_ann = load.get_annotations_tables(conn, group_id)
+    group = conn.getObject("ExperimenterGroup", group_id)
+    context = {
+        "group_id": group_id,
+        "group_name": group.getName(),
+        "group_description": group.getDescription(),
+        "file_ann": file_ann,
+        "map_ann": map_ann,
+    }
+    return serialize(context)
+
+
+def _load_projects_context(conn, project_ids: list[int]) -> dict:
+    """The contexts of the analyzed and harmonized projects, by project id"""
+    context = {}
+    for project_id in project_ids:
+        project_wrapper = conn.getObject("Project", project_id)
+        pm = data_managers.ProjectManager(conn, project_wrapper)
+        pm.load_context()
+        if pm.input_parameters and pm.is_harmonized():
+            context[f"{project_id}"] = pm.context
+    return context
+
+
+@login_required(setGroupContext=True)
+def rebuild_context(request, source, conn=None, **kwargs):
+    """Rebuilds the context stored by a view below from the source it recorded.
+    Called by the Dash callbacks when the context was evicted from the store while
+    the page was still open.
+    """
+    kind = source["kind"]
+    if kind == "image":
+        manager = data_managers.ImageManager(
+            conn, conn.getObject("Image", source["id"])
+        )
+    elif kind == "dataset":
+        manager = data_managers.DatasetManager(
+            conn, conn.getObject("Dataset", source["id"])
+        )
+    elif kind == "project":
+        manager = data_managers.ProjectManager(
+            conn, conn.getObject("Project", source["id"])
+        )
+    elif kind == "group":
+        return _load_group_context(conn, source["id"])
+    elif kind == "projects":
+        return _load_projects_context(conn, source["ids"])
+    else:
+        raise ValueError(f"Unknown context source {kind}")
+    manager.load_context()
+    return manager.context
+
+
 @login_required(setGroupContext=True)
 def center_viewer_image(request, image_id, conn=None, **kwargs):
     dash_context = request.session.get("django_plotly_dash", dict())
@@ -44,7 +102,11 @@ def center_viewer_image(request, image_id, conn=None, **kwargs):
         image_wrapper = conn.getObject("Image", image_id)
         im = data_managers.ImageManager(conn, image_wrapper)
         im.load_context()
-        dash_context["context"] = im.context
+        dash_context["context"] = store_context(
+            im.context,
+            replaces=dash_context.get("context"),
+            source={"kind": "image", "id": image_id},
+        )
         request.session["django_plotly_dash"] = dash_context
         return render(
             request,
@@ -83,7 +145,11 @@ def center_viewer_project(request, project_id, conn=None, **kwargs):
             )
         if pm.mm_dataset_collection:  # There is at least one analyzed dataset
             if pm.is_harmonized():
-                dash_context["context"] = pm.context
+                dash_context["context"] = store_context(
+                    pm.context,
+                    replaces=dash_context.get("context"),
+                    source={"kind": "project", "id": project_id},
+                )
                 request.session["django_plotly_dash"] = dash_context
                 return render(
                     request,
@@ -101,7 +167,11 @@ def center_viewer_project(request, project_id, conn=None, **kwargs):
                     context={"app_name": "WarningApp"},
                 )
         else:  # No analyzed datasets but input parameters configured
-            dash_context["context"] = pm.context
+            dash_context["context"] = store_context(
+                pm.context,
+                replaces=dash_context.get("context"),
+                source={"kind": "project", "id": project_id},
+            )
             request.session["django_plotly_dash"] = dash_context
             return render(
                 request,
@@ -130,19 +200,11 @@ def center_viewer_group(request, conn=None, **kwargs):
             active_group = request.session["active_group"]
         else:
             active_group = conn.getEventContext().groupId
-        file_ann, map_ann = load.get_annotations_tables(conn, active_group)
-        dash_context = request.session.get("django_plotly_dash", dict())
-        group = conn.getObject("ExperimenterGroup", active_group)
-        group_name = group.getName()
-        group_description = group.getDescription()
-        context = {
-            "group_id": active_group,
-            "group_name": group_name,
-            "group_description": group_description,
-            "file_ann": file_ann,
-            "map_ann": map_ann,
-        }
-        dash_context["context"] = context
+        dash_context["context"] = store_context(
+            _load_group_context(conn, active_group),
+            replaces=dash_context.get("context"),
+            source={"kind": "group", "id": active_group},
+        )
         request.session["django_plotly_dash"] = dash_context
         return render(
             request,
@@ -169,7 +231,11 @@ def center_viewer_dataset(request, dataset_id, conn=None, **kwargs):
         dataset_wrapper = conn.getObject("Dataset", dataset_id)
         dm = data_managers.DatasetManager(conn, dataset_wrapper)
         dm.load_context()
-        dash_context["context"] = dm.context
+        dash_context["context"] = store_context(
+            dm.context,
+            replaces=dash_context.get("context"),
+            source={"kind": "dataset", "id": dataset_id},
+        )
         request.session["django_plotly_dash"] = dash_context
         return render(
             request,
@@ -218,15 +284,9 @@ def center_view_projects(request, conn=None, **kwargs):
         )
     try:
         project_ids = [int(i) for i in id_list.split(",")]
-        data = {}
-        for project_id in project_ids:
-            project_wrapper = conn.getObject("Project", project_id)
-            pm = data_managers.ProjectManager(conn, project_wrapper)
-            pm.load_context()
-            if pm.input_parameters and pm.is_harmonized():
-                dash_context["context"][f"{project_id}"] = pm.context
-
-        if not dash_context["context"]:
+        context = _load_projects_context(conn, project_ids)
+
+        if not context:
             dash_context["context"] = {
                 "message": "OMERO-metrics did not detect any analyzed projects in the selection."
             }
@@ -237,6 +297,11 @@ def center_view_projects(request, conn=None, **kwargs):
                 context={"app_name": "WarningApp"},
             )
 
+        dash_context["context"] = store_context(
+            context,
+            replaces=dash_context.get("context"),
+            source={"kind": "projects", "ids": project_ids},
+        )
         request.session["django_plotly_dash"] = dash_context
         return render(
             request,
@@ -256,6 +321,74 @@ def center_view_projects(request, conn=None, **kwargs):
         )
 
 
+def _export_response(
+    conn, omero_datasets, file_name, export_format, as_list, compress
+):
+    """Streams the export of the analyses of the datasets. The connection is closed at the end."""
+    file_anns = load.load_file_annotations(
+        conn, "Dataset", [d.getId() for d in omero_datasets]
+    )
+    mm_datasets = (
+        mm_dataset
+        for mm_dataset in (
+            load.load_dataset(d, load_images=False, file_anns=file_anns[d.getId()])
+            for d in omero_datasets
+        )
+        if mm_dataset is not None
+    )
+    content = export.iter_datasets_export(mm_datasets, export_format, as_list)
+    content_type, extension = export.EXPORT_FORMATS[export_format]
+    file_name = f"{file_name}.{extension}"
+    if compress:
+        content = export.iter_gzip(content)
+        content_type = "application/gzip"
+        file_name = f"{file_name}.gz"
+    response = ConnCleaningHttpResponse(content, content_type=content_type)
+    response.conn = conn
+    response["Content-Disposition"] = f'attachment; filename="{file_name}"'
+    return response
+
+
+@login_required(setGroupContext=True, doConnectionCleanup=False)
+def download_dataset(request, dataset_id, conn=None, **kwargs):
+    """Download the analysis of a dataset.
+    The query parameter format is one of yaml, json or text and gzip=1 compresses the file.
+    """
+    export_format = request.GET.get("format", "yaml")
+    dataset_wrapper = conn.getObject("Dataset", dataset_id)
+    if export_format not in export.EXPORT_FORMATS or dataset_wrapper is None:
+        conn.close(hard=False)
+        return HttpResponseBadRequest("Unknown export format or dataset")
+    return _export_response(
+        conn,
+        [dataset_wrapper],
+        dataset_wrapper.getName(),
+        export_format,
+        as_list=False,
+        compress=request.GET.get("gzip") == "1",
+    )
+
+
+@login_required(setGroupContext=True, doConnectionCleanup=False)
+def download_project(request, project_id, conn=None, **kwargs):
+    """Download the analyses of all the datasets of a project.
+    The query parameter format is one of yaml, json or text and gzip=1 compresses the file.
+    """
+    export_format = request.GET.get("format", "yaml")
+    project_wrapper = conn.getObject("Project", project_id)
+    if export_format not in export.EXPORT_FORMATS or project_wrapper is None:
+        conn.close(hard=False)
+        return HttpResponseBadRequest("Unknown export format or project")
+    return _export_response(
+        conn,
+        sorted(project_wrapper.listChildren(), key=lambda d: d.getId()),
+        project_wrapper.getName(),
+        export_format,
+        as_list=True,
+        compress=request.GET.get("gzip") == "1",
+    )
+
+
 # These views are called from the dash app, and they return a message and a color to display in the app.
 
 
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from omero_metrics.tools.context_loaders import downsample_plane
+
+
+@pytest.mark.parametrize(
+    "shape, max_edge, expected_shape",
+    [
+        ((1024, 1024), 512, (512, 512)),
+        ((2048, 1024), 512, (512, 256)),
+        ((1024, 2048), 512, (256, 512)),
+        ((600, 300), 512, (300, 150)),
+        ((1000, 999), 256, (250, 249)),
+        ((2049, 3), 512, (512, 1)),
+        ((100, 50), 512, (100, 50)),
+    ],
+)
+def test_downsample_plane_shape(shape, max_edge, expected_shape):
+    """Test that planes are downsampled to max_edge keeping their aspect ratio"""
+    plane = np.zeros(shape, dtype=np.uint16)
+    downsampled = downsample_plane(plane, max_edge)
+
+    assert downsampled.shape == expected_shape
+    assert downsampled.dtype == np.float32
+
+
+def test_downsample_plane_block_mean():
+    """Test that every downsampled pixel is the mean of its block"""
+    plane = np.arange(16, dtype=np.uint8).reshape(4, 4)
+    downsampled = downsample_plane(plane, 2)
+
+    np.testing.assert_array_equal(
+        downsampled, plane.reshape(2, 2, 2, 2).mean(axis=(1, 3))
+    )
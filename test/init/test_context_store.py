@@ -0,0 +1,65 @@
+import sys
+import types
+from unittest import mock
+
+import pytest
+
+import omero_metrics
+from omero_metrics.tools import context_store
+
+
+@pytest.fixture()
+def store(monkeypatch):
+    """A context store holding a single context"""
+    store = context_store.MemoryContextStore(max_entries=1)
+    monkeypatch.setattr(context_store, "_context_store", store)
+    return store
+
+
+@pytest.fixture()
+def views(monkeypatch):
+    views = types.SimpleNamespace(rebuild_context=mock.Mock(return_value={"a": 2}))
+    monkeypatch.setitem(sys.modules, "omero_metrics.views", views)
+    monkeypatch.setattr(omero_metrics, "views", views, raising=False)
+    return views
+
+
+def test_get_stored_context(store):
+    session_state = {"context": context_store.store_context({"a": 1})}
+
+    assert context_store.get_context({"session_state": session_state}) == {"a": 1}
+
+
+def test_evicted_context_is_rebuilt(store, views):
+    """Test that a context evicted while the page is open is rebuilt from its source"""
+    source = {"kind": "dataset", "id": 1}
+    session_state = {"context": context_store.store_context({"a": 1}, source=source)}
+    context_store.store_context({"b": 1})
+    request = mock.Mock()
+
+    kwargs = {"session_state": session_state, "request": request}
+    assert context_store.get_context(kwargs) == {"a": 2}
+    views.rebuild_context.assert_called_once_with(request, source)
+    # The rebuilt context is stored under a new token
+    assert context_store.get_context(kwargs) == {"a": 2}
+    views.rebuild_context.assert_called_once()
+
+
+def test_evicted_context_without_source(store, views):
+    """Test that an error context is returned if the context cannot be rebuilt"""
+    session_state = {"context": context_store.store_context({"a": 1})}
+    context_store.store_context({"b": 1})
+
+    context = context_store.get_context(
+        {"session_state": session_state, "request": mock.Mock()}
+    )
+    assert "message" in context
+    views.rebuild_context.assert_not_called()
+
+
+def test_unstored_context():
+    session_state = {"context": {"message": "Warning"}}
+
+    assert context_store.get_context({"session_state": session_state}) == {
+        "message": "Warning"
+    }
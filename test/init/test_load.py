@@ -0,0 +1,76 @@
+import contextlib
+from unittest import mock
+
+import pytest
+
+from omero_metrics.tools import load, omero_tools
+from omero_metrics.tools.dump import _encode_sidecar
+
+SOURCE = {"file_id": 1, "hash": "abc"}
+
+
+def _reader(content: bytes):
+    view = memoryview(content)
+    return lambda offset, length: view[offset : offset + length]
+
+
+@pytest.fixture()
+def dataset_dict():
+    return {
+        "name": "dataset",
+        "processed": True,
+        "output": {
+            "processing_version": "1.0",
+            "key_measurements": {"name": "kkm", "channel_name": ["a", "b"]},
+            "intensity_profiles": [{"name": "profile", "values": [1, 2, 3]}],
+        },
+    }
+
+
+def test_sidecar_round_trip(dataset_dict):
+    """Test that a sidecar decodes back to the dataset it was encoded from"""
+    read = _reader(_encode_sidecar(dataset_dict, SOURCE))
+
+    assert load._read_sidecar(read) == dataset_dict
+    assert load._read_sidecar_index(read)[0]["source"] == SOURCE
+
+
+def test_sidecar_partial_read(dataset_dict):
+    """Test that only the requested output fields and the scalar ones are read"""
+    read = _reader(_encode_sidecar(dataset_dict, SOURCE))
+    data = load._read_sidecar(read, output_fields=["key_measurements"])
+
+    assert data["output"] == {
+        "processing_version": "1.0",
+        "key_measurements": dataset_dict["output"]["key_measurements"],
+    }
+    assert data["name"] == "dataset"
+
+
+def test_sidecar_without_output():
+    """Test that datasets without output can be encoded"""
+    read = _reader(_encode_sidecar({"name": "dataset"}, SOURCE))
+
+    assert load._read_sidecar(read, output_fields=[]) == {"name": "dataset"}
+
+
+@pytest.mark.parametrize(
+    "source", [None, {"file_id": 2, "hash": "abc"}, {"file_id": 1, "hash": "new"}]
+)
+def test_sidecar_of_other_yaml_file_is_ignored(dataset_dict, source, monkeypatch):
+    """Test that a sidecar is not used for another YAML file than its own"""
+    store = mock.Mock(read=_reader(_encode_sidecar(dataset_dict, source)))
+    monkeypatch.setattr(
+        omero_tools, "open_raw_file_store", lambda _: contextlib.nullcontext(store)
+    )
+    read_file = mock.Mock()
+    monkeypatch.setattr(omero_tools, "read_file_annotation", read_file)
+    yaml_ann = mock.Mock()
+    yaml_ann.getFile.return_value.getId.return_value = SOURCE["file_id"]
+    yaml_ann.getFile.return_value.getHash.return_value = SOURCE["hash"]
+
+    sidecar = load._load_mm_dataset_sidecar(
+        mock.Mock(), yaml_ann, "FieldIlluminationDataset"
+    )
+    assert sidecar is None
+    read_file.assert_not_called()
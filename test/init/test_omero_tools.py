@@ -0,0 +1,89 @@
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytest
+from omero import grid
+
+from omero_metrics.tools import omero_tools
+
+
+def test_all_nan_float_column():
+    """Test that a float column without any value is kept as a double column"""
+    column = omero_tools._create_series_column("a", pd.Series([np.nan, np.nan]))
+
+    assert isinstance(column, grid.DoubleColumn)
+    assert np.isnan(column.values).all()
+
+
+def test_all_none_object_column():
+    """Test that an object column without any value is skipped"""
+    assert omero_tools._create_series_column("a", pd.Series([None, None])) is None
+
+
+def test_chunks_after_all_nan_chunk():
+    """Test that chunks are written to a table created from an all-NaN first chunk"""
+    first_chunk = pd.DataFrame({"a": [np.nan, np.nan], "b": [1, 2]})
+    headers = [
+        omero_tools._empty_column(c)
+        for c in omero_tools._create_columns(first_chunk)
+    ]
+    assert [type(h) for h in headers] == [grid.DoubleColumn, grid.LongColumn]
+
+    columns = omero_tools._create_header_columns(
+        pd.DataFrame({"a": [1.5, np.nan], "b": [3, 4]}), headers
+    )
+    np.testing.assert_array_equal(columns[0].values, [1.5, np.nan])
+    np.testing.assert_array_equal(columns[1].values, [3, 4])
+
+
+def test_failed_table_cleanup_keeps_error():
+    """Test that the error writing a table is raised when deleting it fails too"""
+    conn = mock.MagicMock()
+    omero_table = conn.c.sf.sharedResources.return_value.newTable.return_value
+    omero_table.initialize.side_effect = RuntimeError("write")
+    conn.deleteObjects.side_effect = RuntimeError("delete")
+
+    with pytest.raises(RuntimeError, match="write"):
+        omero_tools.create_table(
+            conn, pd.DataFrame({"a": [1.0]}), "table", mock.Mock(), "", None
+        )
+    conn.deleteObjects.assert_called_once()
+
+
+def test_failed_rois_batch_deletes_saved_rois(monkeypatch):
+    """Test that the ROIs of the batches already saved are deleted if a batch fails"""
+    monkeypatch.setattr(omero_tools, "_build_roi", lambda *args: mock.Mock())
+    monkeypatch.setattr(omero_tools, "RoiWrapper", lambda conn, roi: roi)
+    conn = mock.MagicMock()
+    saved_roi = mock.Mock(**{"getId.return_value": 7})
+    conn.getUpdateService.return_value.saveAndReturnArray.side_effect = [
+        [saved_roi],
+        RuntimeError("save"),
+    ]
+
+    with pytest.raises(RuntimeError, match="save"):
+        omero_tools.create_rois(
+            conn, [None, None], [[], []], ["a", "b"], [None, None], batch_size=1
+        )
+    conn.deleteObjects.assert_called_once_with(
+        graph_spec="Roi", obj_ids=[7], wait=True
+    )
+
+
+def test_upload_tiles_as_big_endian_bytes():
+    """Test that tiles are sent as the bytes of their big-endian values"""
+    data = np.arange(2 * 6 * 5, dtype=np.uint16).reshape((1, 2, 1, 6, 5)) * 300
+    store = mock.Mock()
+    tiles = omero_tools._get_tile_list([(0, 1, 0)], data.shape, (4, 4))
+
+    omero_tools._upload_tiles(mock.Mock(), store, data, tiles, window=2)
+
+    assert store.begin_setTile.call_count == len(tiles) == 4
+    assert store.end_setTile.call_count == len(tiles)
+    for (z, c, t, (x, y, w, h)), call in zip(
+        tiles, store.begin_setTile.call_args_list
+    ):
+        tile = np.frombuffer(call.args[0], dtype=">u2").reshape((h, w))
+        np.testing.assert_array_equal(tile, data[z, c, t, y : y + h, x : x + w])
+        assert call.args[1:8] == (z, c, t, x, y, w, h)
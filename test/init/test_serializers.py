@@ -0,0 +1,219 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from microscopemetrics_schema.datamodel import microscopemetrics_schema as mm_schema
+
+from omero_metrics.tools.cache import get_blob_store
+from omero_metrics.tools.serializers import (
+    DATAFRAME_MARKER,
+    HASH_MARKER,
+    MM_SCHEMA_MARKER,
+    deserialize,
+    deserialize_dataframe,
+    deserialize_numpy,
+    serialize,
+    serialize_dataframe,
+    serialize_mm_schema_obj,
+    serialize_numpy,
+)
+
+
+def _through_json(obj):
+    """Returns obj as stored in the session"""
+    return json.loads(json.dumps(obj))
+
+
+@pytest.fixture()
+def df():
+    return pd.DataFrame(
+        {
+            "int": np.array([1, 2, 3], dtype=np.int64),
+            "uint8": np.array([1, 2, 3], dtype=np.uint8),
+            "float32": np.array([1.5, np.nan, 3], dtype=np.float32),
+            "bool": [True, False, True],
+            "nullable_int": pd.array([1, None, 3], dtype="Int64"),
+            "nullable_bool": pd.array([True, None, False], dtype="boolean"),
+            "string": pd.array(["a", None, "c"], dtype="string"),
+            "object": ["a", None, "c"],
+            "category": pd.Categorical(
+                ["x", "y", "x"], categories=["y", "x"], ordered=True
+            ),
+            "datetime": pd.to_datetime(["2024-01-01", "2024-01-02", None]),
+            "datetime_tz": pd.to_datetime(
+                ["2024-01-01 10:00", "2024-01-02 10:00", "2024-01-03 10:00"]
+            ).tz_localize("Europe/Paris"),
+            "timedelta": pd.to_timedelta([1, 2, 3], unit="s"),
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "index",
+    [
+        pd.RangeIndex(3),
+        pd.RangeIndex(10, 16, 2, name="range"),
+        pd.Index([10, 20, 30], name="id"),
+        pd.Index(["a", "b", "c"]),
+        pd.CategoricalIndex(["a", "b", "a"]),
+        pd.DatetimeIndex(["2024-01-01", "2024-01-02", "2024-01-03"]),
+    ],
+)
+def test_dataframe_round_trip(df, index):
+    """Test that frames round-trip with their dtypes, columns and index"""
+    df.index = index
+    deserialized = deserialize_dataframe(_through_json(serialize_dataframe(df)))
+
+    pd.testing.assert_frame_equal(deserialized, df)
+    assert type(deserialized.index) is type(df.index)
+
+
+def test_dataframe_duplicated_and_non_string_columns():
+    """Test that frames keep duplicated and integer column labels"""
+    df = pd.DataFrame([[1, 2.0, "a"]], columns=[0, "a", "a"])
+    deserialized = deserialize_dataframe(_through_json(serialize_dataframe(df)))
+
+    pd.testing.assert_frame_equal(deserialized, df)
+
+
+def test_dataframe_split_format():
+    """Test that frames serialized with the former split format are still loaded"""
+    df = pd.DataFrame({"a": [1, 2], "b": ["x", "y"]}, index=[3, 4])
+    serialized = {DATAFRAME_MARKER: True, "data": df.to_dict(orient="split")}
+
+    pd.testing.assert_frame_equal(deserialize(_through_json(serialized)), df)
+
+
+def test_blob_reference():
+    """Test that large arrays are only referenced in the session"""
+    arr = np.random.default_rng(0).random((128, 128))
+    serialized = _through_json(serialize_numpy(arr, blob_threshold=1024))
+    assert "data" not in serialized
+    assert get_blob_store().has(serialized["blob"])
+
+    deserialized = deserialize_numpy(serialized)
+    np.testing.assert_array_equal(deserialized, arr)
+    assert not deserialized.flags.writeable
+
+
+def test_small_array_in_session():
+    """Test that small arrays and arrays with the blob store disabled stay in the session"""
+    arr = np.arange(10, dtype=np.int16)
+    for serialized in [
+        serialize_numpy(arr),
+        serialize_numpy(arr, blob_threshold=None),
+    ]:
+        assert "blob" not in serialized
+        np.testing.assert_array_equal(
+            deserialize_numpy(_through_json(serialized)), arr
+        )
+
+
+@pytest.mark.parametrize(
+    "arr, stored_dtype",
+    [
+        (np.arange(1000, dtype=np.int64) % 100, "uint8"),
+        (np.arange(1000, dtype=np.float64) - 500, "int16"),
+        (np.linspace(0, 1, 1000), None),
+        (np.array([1.0, np.nan]), None),
+    ],
+)
+def test_codec_and_narrowing(arr, stored_dtype):
+    """Test that arrays are narrowed only without loss and compressed"""
+    serialized = _through_json(
+        serialize_numpy(arr, blob_threshold=None, codec="zlib", narrow_dtype=True)
+    )
+    assert serialized.get("stored_dtype") == stored_dtype
+    assert serialized["codec"] == "zlib"
+
+    deserialized = deserialize_numpy(serialized)
+    assert deserialized.dtype == arr.dtype
+    np.testing.assert_array_equal(deserialized, arr)
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        serialize_numpy(np.arange(3), codec="unknown")
+
+
+def test_trusted_schema_object():
+    """Test that schema objects serialized by serialize are rebuilt without validation"""
+    channel = mm_schema.Channel(name="c0", excitation_wavelength_nm=488.0)
+    serialized = _through_json(serialize({"channel": channel}))
+    assert serialized["channel"]["trusted"]
+
+    deserialized = deserialize(serialized)["channel"]
+    assert isinstance(deserialized, mm_schema.Channel)
+    assert deserialized == channel
+
+
+def test_untrusted_schema_object():
+    """Test that schema objects of other origins are validated"""
+    channel = mm_schema.Channel(name="c0", excitation_wavelength_nm=488.0)
+    serialized = _through_json(serialize_mm_schema_obj(channel))
+    assert "trusted" not in serialized
+
+    assert deserialize(serialized) == channel
+
+
+def test_top_level_schema_object():
+    """Test that a schema object serialized on its own round-trips"""
+    channel = mm_schema.Channel(name="c0", excitation_wavelength_nm=488.0)
+    serialized = _through_json(serialize(channel))
+    assert serialized[MM_SCHEMA_MARKER] == "Channel"
+
+    assert deserialize(serialized) == channel
+
+
+def test_trusted_schema_object_from_other_schema_version():
+    """Test that trusted data missing fields of the class is validated"""
+    channel = mm_schema.Channel(name="c0", excitation_wavelength_nm=488.0)
+    serialized = _through_json(serialize(channel))
+    # The stamp no longer matches the content
+    del serialized[HASH_MARKER]
+    del serialized["data"]["emission_wavelength_nm"]
+
+    assert deserialize(serialized) == channel
+
+    serialized["data"]["unknown_field"] = 1
+    with pytest.raises(TypeError):
+        deserialize(serialized)
+
+
+def test_deserialize_changes_are_not_shared():
+    """Test that a caller changing a deserialized context does not change it for the next"""
+    context = {
+        "df": pd.DataFrame({"a": [1.0, 2.0], "b": ["x", "y"]}),
+        "channel": mm_schema.Channel(name="c0", excitation_wavelength_nm=488.0),
+        "values": [1, 2],
+    }
+    serialized = serialize(context, blob_threshold=None)
+
+    first = deserialize(serialized)
+    first["df"]["c"] = 0
+    try:
+        first["df"].loc[0, "a"] = 5.0
+    except ValueError:
+        # Without copy-on-write the shared values are read-only
+        pass
+    first["channel"].name = "changed"
+    first["values"].append(3)
+
+    second = deserialize(serialized)
+    assert second["df"].columns.tolist() == ["a", "b"]
+    assert second["df"]["a"].tolist() == [1.0, 2.0]
+    assert second["channel"].name == "c0"
+    assert second["values"] == [1, 2]
+
+
+def test_narrowed_blob_shrinks():
+    """Test that an array stored in the blob store is narrowed when opted in"""
+    arr = np.arange(256 * 256, dtype=np.float64).reshape(256, 256) % 200
+    serialized = serialize_numpy(arr, narrow_dtype=True)
+    assert serialized["stored_dtype"] == "uint8"
+    assert get_blob_store().get(serialized["blob"]).nbytes == arr.size
+
+    deserialized = deserialize_numpy(serialized)
+    assert deserialized.dtype == arr.dtype
+    np.testing.assert_array_equal(deserialized, arr)
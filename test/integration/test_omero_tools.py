@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from omero.gateway import BlitzGateway
+from omeroweb.testlib import IWebTest
+
+from omero_metrics.tools import omero_tools
+
+
+def get_connection(user, group_id=None):
+    """Get a BlitzGateway connection for the given user's client."""
+    connection = BlitzGateway(client_obj=user[0])
+    connection.getEventContext()
+    if group_id is not None:
+        connection.SERVICE_OPTS.setOmeroGroup(group_id)
+    return connection
+
+
+class TestCreateImage(IWebTest):
+    """Tests writing images to OMERO."""
+
+    @pytest.fixture()
+    def user1(self):
+        """Return a new user in a read-annotate group."""
+        user = self.new_client_and_user(privileges=None)
+        return user
+
+    def test_tiled_image_round_trip(self, user1):
+        """Test that an image larger than the planes OMERO accepts is uploaded in tiles"""
+        conn = get_connection(user1)
+        max_x, _ = conn.getMaxPlaneSize()
+        # zctyx, wider than a plane and not a multiple of the tile size
+        data = np.random.default_rng(0).integers(
+            0, 2**16, size=(1, 2, 1, 16, max_x + 10), dtype=np.uint16
+        )
+
+        image = omero_tools.create_image_from_numpy_array(
+            conn=conn,
+            data=data,
+            image_name="tiled",
+            channel_labels=["c0", "c1"],
+        )
+
+        image = conn.getObject("Image", image.getId())
+        assert (image.getSizeX(), image.getSizeY(), image.getSizeC()) == (
+            max_x + 10,
+            16,
+            2,
+        )
+        pixels = image.getPrimaryPixels()
+        for c in range(2):
+            # The first tile and a region across the boundary of the tiles
+            for x, w in [(0, 100), (max_x - 5, 15)]:
+                tile = pixels.getTile(0, c, 0, tile=(x, 0, w, 16))
+                np.testing.assert_array_equal(tile, data[0, c, 0, :, x : x + w])